@@ -0,0 +1,349 @@
+import pickle
+from collections import OrderedDict
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import geo
+from data_downloader import GeometryFormatter, OpenDataDownloader
+from paths import DATA_FOLDER
+
+STREET_NAME_ABBREVIATIONS = {
+    "STREET": "ST",
+    "AVENUE": "AVE",
+    "AV": "AVE",
+    "ROAD": "RD",
+    "BOULEVARD": "BLVD",
+    "PLACE": "PL",
+    "DRIVE": "DR",
+    "LANE": "LN",
+    "COURT": "CT",
+    "TERRACE": "TER",
+    "PARKWAY": "PKWY",
+    "EXPRESSWAY": "EXPY",
+    "HIGHWAY": "HWY",
+    "EAST": "E",
+    "WEST": "W",
+    "NORTH": "N",
+    "SOUTH": "S",
+}
+
+BOROUGH_CODES = {
+    "MANHATTAN": "1",
+    "BRONX": "2",
+    "BROOKLYN": "3",
+    "QUEENS": "4",
+    "STATEN ISLAND": "5",
+}
+
+
+def normalize_street_names(names: pd.Series) -> pd.Series:
+    """Upper-cases, drops ordinal suffixes and abbreviates street types, so that
+    crash report spellings match the centerline ones ("WEST 42ND STREET" and
+    "W 42 ST" both become "W 42 ST")."""
+    abbreviations = "|".join(STREET_NAME_ABBREVIATIONS)
+    return (
+        names.astype("string")
+        .str.upper()
+        .str.replace(r"[^\w\s]", " ", regex=True)
+        .str.replace(r"\b(\d+)(?:ST|ND|RD|TH)\b", r"\1", regex=True)
+        .str.replace(
+            rf"\b(?:{abbreviations})\b",
+            lambda match: STREET_NAME_ABBREVIATIONS[match.group(0)],
+            regex=True,
+        )
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+    )
+
+
+def house_numbers_to_int(numbers: pd.Series) -> pd.Series:
+    """Maps house numbers to integers; hyphenated Queens numbers such as
+    "100-10" become 100010 so that they still order correctly."""
+    parts = numbers.astype("string").str.strip().str.extract(r"^(\d+)(?:-(\d+))?$")
+    block = pd.to_numeric(parts[0], errors="coerce")
+    house = pd.to_numeric(parts[1], errors="coerce")
+    return block.where(house.isna(), block * 1000 + house)
+
+
+class CenterlineGeocoder:
+    """Offline geocoder resolving addresses and intersections against the
+    centerline dataset, with a persistent LRU cache of resolved queries."""
+
+    def __init__(
+        self,
+        centerline: gpd.GeoDataFrame,
+        *,
+        name_column: str = "full_stree",
+        cache_path: Path | None = DATA_FOLDER / "geocoder_cache.pkl",
+        cache_size: int = 500_000,
+        snap_tolerance: float = 1.0,
+    ):
+        self.cache_path = cache_path
+        self.cache_size = cache_size
+        self.cache: OrderedDict = OrderedDict()
+        if cache_path is not None and cache_path.exists():
+            with open(cache_path, "rb") as f:
+                self.cache = pickle.load(f)
+
+        centerline = centerline.to_crs(geo.NYC_EPSG)
+        self.geometry = centerline.geometry.values
+        self.__build_address_index(centerline, name_column)
+        self.__build_intersection_index(centerline, name_column, snap_tolerance)
+
+    @classmethod
+    def from_cached_centerline(
+        cls, app_token: str | None = None, **kwargs
+    ) -> "CenterlineGeocoder":
+        centerline = OpenDataDownloader(app_token).load_data("centerline")
+        return cls(
+            GeometryFormatter(centerline).from_geometry_column("the_geom"), **kwargs
+        )
+
+    def __build_address_index(
+        self, centerline: gpd.GeoDataFrame, name_column: str
+    ) -> None:
+        names = normalize_street_names(centerline[name_column])
+        sides = []
+        for side in ["l", "r"]:
+            low = house_numbers_to_int(centerline[f"{side}_low_hn"])
+            high = house_numbers_to_int(centerline[f"{side}_high_hn"])
+            sides.append(
+                pd.DataFrame(
+                    {
+                        "name": names.to_numpy(),
+                        "borough": centerline["borocode"].astype("string").to_numpy(),
+                        "segment": np.arange(len(centerline)),
+                        "low": low.to_numpy(),
+                        "high": high.to_numpy(),
+                    }
+                )
+            )
+        self.address_index = pd.concat(sides, ignore_index=True).dropna(
+            subset=["name", "low", "high"]
+        )
+
+    def __build_intersection_index(
+        self, centerline: gpd.GeoDataFrame, name_column: str, snap_tolerance: float
+    ) -> None:
+        parts, segment = shapely.get_parts(self.geometry, return_index=True)
+        endpoints = np.concatenate(
+            [
+                shapely.get_coordinates(shapely.get_point(parts, 0)),
+                shapely.get_coordinates(shapely.get_point(parts, -1)),
+            ]
+        )
+        segment = np.concatenate([segment, segment])
+        snapped = np.round(endpoints / snap_tolerance).astype(np.int64)
+        names = normalize_street_names(centerline[name_column]).to_numpy()
+        boroughs = centerline["borocode"].astype("string").to_numpy()
+        self.intersection_index = (
+            pd.DataFrame(
+                {
+                    "name": names[segment],
+                    "borough": boroughs[segment],
+                    "node_x": snapped[:, 0],
+                    "node_y": snapped[:, 1],
+                    "x": endpoints[:, 0],
+                    "y": endpoints[:, 1],
+                }
+            )
+            .dropna(subset=["name"])
+            .drop_duplicates(subset=["name", "borough", "node_x", "node_y"])
+        )
+
+    def __cache_lookup(self, keys: list) -> dict:
+        found = {}
+        for key in keys:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                found[key] = self.cache[key]
+        return found
+
+    def __cache_store(self, results: dict) -> None:
+        self.cache.update(results)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def save_cache(self) -> None:
+        if self.cache_path is not None:
+            with open(self.cache_path, "wb") as f:
+                pickle.dump(self.cache, f)
+
+    def __geocode_cached(
+        self, queries: pd.DataFrame, kind: str, resolve
+    ) -> pd.DataFrame:
+        """Looks the queries up in the cache, resolves the misses in one batch
+        with `resolve`, and returns latitude/longitude aligned with `queries`."""
+        keys = [(kind, *row) for row in queries.itertuples(index=False, name=None)]
+        results = self.__cache_lookup(list(dict.fromkeys(keys)))
+        misses = queries[[key not in results for key in keys]].drop_duplicates().copy()
+        if len(misses) > 0:
+            x, y = resolve(misses)
+            points = gpd.GeoSeries(gpd.points_from_xy(x, y), crs=geo.NYC_EPSG).to_crs(
+                geo.STD_EPSG
+            )
+            resolved = {
+                (kind, *row): (lat, lon)
+                for row, lat, lon in zip(
+                    misses.itertuples(index=False, name=None),
+                    points.y.to_numpy(),
+                    points.x.to_numpy(),
+                )
+            }
+            self.__cache_store(resolved)
+            results.update(resolved)
+        coordinates = np.array([results[key] for key in keys], dtype=float).reshape(
+            -1, 2
+        )
+        return pd.DataFrame(
+            coordinates, index=queries.index, columns=["latitude", "longitude"]
+        )
+
+    def __resolve_addresses(self, queries: pd.DataFrame) -> tuple[np.ndarray, ...]:
+        parts = queries["address"].str.extract(r"^\s*(\d+(?:-\d+)?)\s+(.+)$")
+        lookup = pd.DataFrame(
+            {
+                "query": np.arange(len(queries)),
+                "number": house_numbers_to_int(parts[0]).to_numpy(),
+                "name": normalize_street_names(parts[1]).to_numpy(),
+                "borough": queries["borough"].to_numpy(),
+            }
+        ).dropna(subset=["number", "name"])
+        candidates = lookup.merge(self.address_index, on="name", suffixes=("", "_seg"))
+        low = np.minimum(candidates["low"], candidates["high"])
+        high = np.maximum(candidates["low"], candidates["high"])
+        candidates = candidates[
+            (candidates["number"] >= low)
+            & (candidates["number"] <= high)
+            & (
+                candidates["borough"].isna()
+                | (candidates["borough"] == candidates["borough_seg"]).fillna(False)
+            )
+        ].drop_duplicates(subset="query")
+        span = (candidates["high"] - candidates["low"]).to_numpy(dtype=float)
+        fraction = np.where(
+            span != 0,
+            (candidates["number"] - candidates["low"]).to_numpy(dtype=float)
+            / np.where(span != 0, span, 1),
+            0.5,
+        )
+        points = shapely.line_interpolate_point(
+            self.geometry[candidates["segment"].to_numpy()],
+            np.clip(fraction, 0, 1),
+            normalized=True,
+        )
+        x = np.full(len(queries), np.nan)
+        y = np.full(len(queries), np.nan)
+        x[candidates["query"].to_numpy()] = shapely.get_x(points)
+        y[candidates["query"].to_numpy()] = shapely.get_y(points)
+        return x, y
+
+    def __resolve_intersections(self, queries: pd.DataFrame) -> tuple[np.ndarray, ...]:
+        lookup = pd.DataFrame(
+            {
+                "query": np.arange(len(queries)),
+                "on_name": normalize_street_names(queries["on_street"]).to_numpy(),
+                "cross_name": normalize_street_names(
+                    queries["cross_street"]
+                ).to_numpy(),
+                "query_borough": queries["borough"].to_numpy(),
+            }
+        ).dropna(subset=["on_name", "cross_name"])
+        on_nodes = lookup.merge(
+            self.intersection_index, left_on="on_name", right_on="name"
+        )
+        on_nodes = on_nodes[
+            on_nodes["query_borough"].isna()
+            | (on_nodes["query_borough"] == on_nodes["borough"]).fillna(False)
+        ]
+        shared_nodes = on_nodes.merge(
+            self.intersection_index[["name", "borough", "node_x", "node_y"]],
+            left_on=["cross_name", "borough", "node_x", "node_y"],
+            right_on=["name", "borough", "node_x", "node_y"],
+        ).drop_duplicates(subset="query")
+        x = np.full(len(queries), np.nan)
+        y = np.full(len(queries), np.nan)
+        x[shared_nodes["query"].to_numpy()] = shared_nodes["x"].to_numpy()
+        y[shared_nodes["query"].to_numpy()] = shared_nodes["y"].to_numpy()
+        return x, y
+
+    def geocode_addresses(
+        self, addresses: pd.Series, boroughs: pd.Series | None = None
+    ) -> pd.DataFrame:
+        """Geocodes "<house number> <street>" addresses, optionally restricted to
+        the given borough names. Unresolved addresses get NaN coordinates."""
+        queries = pd.DataFrame(
+            {
+                "address": addresses.astype("string").str.upper().str.strip(),
+                "borough": self.__get_borough_codes(boroughs, addresses.index),
+            },
+            index=addresses.index,
+        )
+        return self.__geocode_cached(queries, "address", self.__resolve_addresses)
+
+    def geocode_intersections(
+        self,
+        on_streets: pd.Series,
+        cross_streets: pd.Series,
+        boroughs: pd.Series | None = None,
+    ) -> pd.DataFrame:
+        """Geocodes the intersection of each (on street, cross street) pair to the
+        centerline node the two streets share."""
+        queries = pd.DataFrame(
+            {
+                "on_street": on_streets.astype("string").str.upper().str.strip(),
+                "cross_street": cross_streets.astype("string").str.upper().str.strip(),
+                "borough": self.__get_borough_codes(boroughs, on_streets.index),
+            },
+            index=on_streets.index,
+        )
+        return self.__geocode_cached(
+            queries, "intersection", self.__resolve_intersections
+        )
+
+    def geocode(self, address: str, borough: str | None = None) -> tuple[float, float]:
+        coordinates = self.geocode_addresses(
+            pd.Series([address]), None if borough is None else pd.Series([borough])
+        )
+        return tuple(coordinates.iloc[0])
+
+    def __get_borough_codes(
+        self, boroughs: pd.Series | None, index: pd.Index
+    ) -> pd.Series:
+        if boroughs is None:
+            return pd.Series(pd.NA, index=index, dtype="string")
+        return (
+            boroughs.astype("string").str.upper().str.strip().map(BOROUGH_CODES)
+        ).astype("string")
+
+
+def geocode_sorted_crashes(geocoder: CenterlineGeocoder, file_name_no_csv: str):
+    """Adds latitude/longitude to the outputs of `location_type_sorter`."""
+    off_street = pd.read_csv(file_name_no_csv + "_off_street.csv", index_col=0)
+    off_street[["LATITUDE", "LONGITUDE"]] = geocoder.geocode_addresses(
+        off_street["OFF STREET NAME"], off_street["BOROUGH"]
+    ).to_numpy()
+    off_street.to_csv(file_name_no_csv + "_off_street_geocoded.csv")
+
+    cross_street = pd.read_csv(file_name_no_csv + "_cross_street.csv", index_col=0)
+    cross_street[["LATITUDE", "LONGITUDE"]] = geocoder.geocode_intersections(
+        cross_street["ON STREET NAME"],
+        cross_street["CROSS STREET NAME"],
+        cross_street["BOROUGH"],
+    ).to_numpy()
+    cross_street.to_csv(file_name_no_csv + "_cross_street_geocoded.csv")
+    geocoder.save_cache()
+
+
+def main():
+    file_name_no_csv = str(DATA_FOLDER / "Motor_Vehicle_Collisions_-_Crashes_20240318")
+    geocoder = CenterlineGeocoder.from_cached_centerline()
+    geocode_sorted_crashes(geocoder, file_name_no_csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ import geo
 import geopandas as gpd
 import pandas as pd
 from pathlib import Path
-from shapely import empty, GeometryType, union_all
+from shapely import empty, GeometryType, to_wkb, union_all
 
 
 class CrashDataService:
@@ -23,6 +23,12 @@ class CrashDataService:
         self.from_year = from_year
         self.columns = extra_columns
         self.limit = limit
+        # Streets, their buffers and the intersection split are reused across calls
+        self.__streets: gpd.GeoDataFrame | None = None
+        self.__buffered_streets: dict[int, gpd.GeoDataFrame] = {}
+        self.__intersection_crashes: dict[
+            int, tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]
+        ] = {}
         self.__load_crashes_dataset(self.limit)
 
     def __load_crashes_dataset(self, limit: int = 3000000) -> gpd.GeoDataFrame:
@@ -40,15 +46,15 @@ class CrashDataService:
             for col in self.columns:
                 if col not in columns_to_return:
                     columns_to_return.append(col)
-        self.crashes = self.crashes[columns_to_return]
-        self.crashes.dropna(subset=["longitude", "latitude"], inplace=True)
-        self.crashes["datetime"] = self.crashes[["crash_date", "crash_time"]].apply(
-            lambda o: self.__get_datetime(o["crash_date"], o["crash_time"]), axis=1
+        self.crashes = self.crashes[columns_to_return].dropna(
+            subset=["longitude", "latitude"]
+        )
+        self.crashes["datetime"] = self.__get_datetimes(
+            self.crashes["crash_date"], self.crashes["crash_time"]
         )
-        self.crashes.drop(columns=["crash_date", "crash_time"], inplace=True)
         self.crashes = self.crashes[
-            self.crashes.datetime >= datetime(self.from_year, 1, 1)
-        ]
+            self.crashes["datetime"] >= datetime(self.from_year, 1, 1)
+        ].drop(columns=["crash_date", "crash_time"])
         self.crashes = gpd.GeoDataFrame(
             self.crashes,
             geometry=gpd.points_from_xy(
@@ -91,11 +97,13 @@ class CrashDataService:
         empty_multiline_string = empty(1, GeometryType.MULTILINESTRING)[0]
         humps = humps[humps.geometry != empty_multiline_string]
         humps["humps"] = humps["humps"].astype(float)
-        humps["date_insta"] = humps["date_insta"].apply(self.__get_datetime)
-        humps = humps.groupby(by="geometry", as_index=False).agg(
-            {"humps": "sum", "date_insta": "min"}
+        humps["date_insta"] = self.__get_datetimes(humps["date_insta"])
+        humps = (
+            humps.groupby(by=self.__get_geometry_keys(humps))
+            .agg({"humps": "sum", "date_insta": "min", "geometry": "first"})
+            .reset_index(drop=True)
         )
-        humps = gpd.GeoDataFrame(humps, crs=geo.NYC_EPSG)
+        humps = gpd.GeoDataFrame(humps, geometry="geometry", crs=geo.NYC_EPSG)
         humps["geometry"] = humps.geometry.centroid
         return humps
 
@@ -108,10 +116,14 @@ class CrashDataService:
         )
         speed_limits = speed_limits[["postvz_sl", "geometry"]]
         speed_limits["postvz_sl"] = speed_limits["postvz_sl"].astype(int)
-        speed_limits = speed_limits.groupby(by="geometry", as_index=False)[
-            "postvz_sl"
-        ].mean()
-        speed_limits = gpd.GeoDataFrame(speed_limits, crs=geo.NYC_EPSG)
+        speed_limits = (
+            speed_limits.groupby(by=self.__get_geometry_keys(speed_limits))
+            .agg({"postvz_sl": "mean", "geometry": "first"})
+            .reset_index(drop=True)
+        )
+        speed_limits = gpd.GeoDataFrame(
+            speed_limits, geometry="geometry", crs=geo.NYC_EPSG
+        )
         speed_limits["geometry"] = speed_limits.geometry.centroid
         return speed_limits
 
@@ -122,13 +134,18 @@ class CrashDataService:
         trees = trees[["tree_id", "geometry"]]
         return trees
 
-    def __get_datetime(self, date: str, time: str | None = None) -> datetime:
-        year, month, day = list(map(int, date.split("T")[0].split("-")))
-        if time is None:
-            hour, minute = 0, 0
-        else:
-            hour, minute = list(map(int, time.split(":")))
-        return datetime(year, month, day, hour, minute)
+    def __get_datetimes(
+        self, dates: pd.Series, times: pd.Series | None = None
+    ) -> pd.Series:
+        """Parses ISO dates (and optional "H:MM" times) in bulk."""
+        dates = dates.str.slice(0, 10)
+        if times is None:
+            return pd.to_datetime(dates, format="%Y-%m-%d")
+        return pd.to_datetime(dates + " " + times, format="%Y-%m-%d %H:%M")
+
+    def __get_geometry_keys(self, df: gpd.GeoDataFrame) -> pd.Series:
+        """WKB encodings of the geometries, which hash far faster than shapes."""
+        return pd.Series(to_wkb(df.geometry.values), index=df.index, name="wkb")
 
     def __spatial_join_to_street_data(
         self,
@@ -137,8 +154,11 @@ class CrashDataService:
         agg_column: str | list[str],
         agg_op: str | list[str],
     ) -> gpd.GeoDataFrame:
-        street_data_cols = list(street_data.columns)
-        street_data = street_data.sjoin(right_df, how="left")
+        # Aggregate on a positional row key and join back, rather than grouping
+        # by every street column (including the polygon geometry). physicalid is
+        # not unique here and may be null, so it cannot serve as the key.
+        street_data = street_data.reset_index(drop=True)
+        joined = street_data[["geometry"]].sjoin(right_df, how="left")
         if isinstance(agg_column, str):
             agg_dict = {agg_column: pd.NamedAgg(column=agg_column, aggfunc=agg_op)}
         else:
@@ -146,35 +166,44 @@ class CrashDataService:
                 col: pd.NamedAgg(column=col, aggfunc=op)
                 for col, op in zip(agg_column, agg_op)
             }
-        street_data = street_data.groupby(
-            by=street_data_cols, as_index=False, dropna=False
-        ).agg(**agg_dict)
-        street_data = gpd.GeoDataFrame(street_data, crs=geo.NYC_EPSG)
-        return street_data
+        aggregates = joined.groupby(level=0).agg(**agg_dict)
+        return street_data.join(aggregates)
+
+    def __get_buffered_streets(self, buffer: int) -> gpd.GeoDataFrame:
+        if self.__streets is None:
+            self.__streets = self.__load_streets_dataset(
+                limit=self.limit,
+                columns_to_load=["geometry", "physicalid", "shape_leng", "st_width"],
+            )
+        if buffer not in self.__buffered_streets:
+            buffered_streets = self.__streets.copy()
+            buffered_streets["geometry"] = buffered_streets.geometry.buffer(buffer)
+            self.__buffered_streets[buffer] = buffered_streets
+        return self.__buffered_streets[buffer].copy()
 
     def __get_intersection_crashes(
-        self, street_geometry: gpd.GeoDataFrame, buffer: int
-    ) -> gpd.GeoDataFrame:
-        street_geometry["intersections"] = street_geometry.geometry.boundary.buffer(
-            buffer
-        )
-        intersections = gpd.GeoDataFrame(
-            street_geometry[["physicalid", "intersections"]],
-            crs=geo.NYC_EPSG,
-            geometry="intersections",
-        )
-        intersection_crashes_ids = (
-            self.crashes[["collision_id", "geometry"]]
-            .sjoin(intersections, how="inner", predicate="within")["collision_id"]
-            .drop_duplicates()
-        )
-        intersection_crashes_mask = self.crashes["collision_id"].isin(
-            intersection_crashes_ids.values
-        )
-        return (
-            self.crashes[intersection_crashes_mask],
-            self.crashes[~intersection_crashes_mask],
-        )
+        self, buffer: int
+    ) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+        if buffer not in self.__intersection_crashes:
+            self.__get_buffered_streets(buffer)
+            intersections = gpd.GeoDataFrame(
+                self.__streets[["physicalid"]],
+                geometry=self.__streets.geometry.boundary.buffer(buffer),
+                crs=geo.NYC_EPSG,
+            )
+            intersection_crashes_ids = (
+                self.crashes[["collision_id", "geometry"]]
+                .sjoin(intersections, how="inner", predicate="within")["collision_id"]
+                .drop_duplicates()
+            )
+            intersection_crashes_mask = self.crashes["collision_id"].isin(
+                intersection_crashes_ids.values
+            )
+            self.__intersection_crashes[buffer] = (
+                self.crashes[intersection_crashes_mask],
+                self.crashes[~intersection_crashes_mask],
+            )
+        return self.__intersection_crashes[buffer]
 
     def get_non_intersection_info(
         self,
@@ -194,14 +223,8 @@ class CrashDataService:
         ]
         if self.columns is not None:
             final_cols += self.columns
-        street_data = self.__load_streets_dataset(
-            limit=self.limit,
-            columns_to_load=["geometry", "physicalid", "shape_leng", "st_width"],
-        )
-        _, non_intersection_crashes = self.__get_intersection_crashes(
-            street_data, buffer
-        )
-        street_data["geometry"] = street_data.geometry.buffer(buffer)
+        street_data = self.__get_buffered_streets(buffer)
+        _, non_intersection_crashes = self.__get_intersection_crashes(buffer)
         if join_speed_humps:
             humps = self.__load_speed_humps_dataset(limit=self.limit)
             street_data = self.__spatial_join_to_street_data(
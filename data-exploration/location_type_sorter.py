@@ -1,40 +1,63 @@
 import pandas as pd
 
+# Columns kept in the off-street and cross-street outputs, with their dtypes
+COLUMN_DTYPES = {
+    "CRASH DATE": "string",
+    "CRASH TIME": "string",
+    "BOROUGH": "string",
+    "ZIP CODE": "string",
+    "LATITUDE": "float64",
+    "LONGITUDE": "float64",
+    "ON STREET NAME": "string",
+    "CROSS STREET NAME": "string",
+    "OFF STREET NAME": "string",
+    "NUMBER OF PERSONS INJURED": "float64",
+    "NUMBER OF PERSONS KILLED": "float64",
+    "COLLISION_ID": "int64",
+}
 
-def get_off_cross_streets(file_name_no_csv):
+
+def get_off_cross_streets(
+    file_name_no_csv: str,
+    chunksize: int | None = 500_000,
+    columns: list[str] | None = list(COLUMN_DTYPES),
+):
+    """Splits injury crashes without coordinates into those with an off-street
+    address and those with an on/cross street pair.
+
+    The CSV is streamed `chunksize` rows at a time and the results are appended
+    to the outputs, so memory use does not grow with the size of the export.
+    Set `columns` to None to keep every column of the raw export.
+    """
     file_path = file_name_no_csv + ".csv"
     off_street_file_path = file_name_no_csv + "_off_street.csv"
     cross_street_file_path = file_name_no_csv + "_cross_street.csv"
 
-    def is_not_white_space(s: str) -> bool:
-        if type(s) is not str:
-            return
-        return not s.isspace()
-
-    df_no_ll_inj = pd.read_csv(file_path)
-    df_no_ll_inj = df_no_ll_inj[
-        df_no_ll_inj["LATITUDE"].isna()
-        & (
-            (
-                df_no_ll_inj["NUMBER OF PERSONS INJURED"]
-                + df_no_ll_inj["NUMBER OF PERSONS KILLED"]
-            )
-            > 0
+    dtypes = COLUMN_DTYPES
+    if columns is not None:
+        dtypes = {col: dtype for col, dtype in COLUMN_DTYPES.items() if col in columns}
+    reader = pd.read_csv(file_path, usecols=columns, dtype=dtypes, chunksize=chunksize)
+    chunks = [reader] if chunksize is None else reader
+
+    for i, df in enumerate(chunks):
+        mode, header = ("w", True) if i == 0 else ("a", False)
+        df_no_ll_inj = df[
+            df["LATITUDE"].isna()
+            & ((df["NUMBER OF PERSONS INJURED"] + df["NUMBER OF PERSONS KILLED"]) > 0)
+        ]
+
+        off_street_name = df_no_ll_inj["OFF STREET NAME"]
+        is_off_street = off_street_name.notna() & ~off_street_name.str.isspace()
+        df_no_ll_inj[is_off_street].to_csv(
+            off_street_file_path, mode=mode, header=header
         )
-    ]
-
-    df_off_street = df_no_ll_inj[
-        df_no_ll_inj["OFF STREET NAME"].notna()
-        & df_no_ll_inj["OFF STREET NAME"].apply(is_not_white_space)
-    ]
-    df_off_street.to_csv(off_street_file_path)
-
-    df_cross_street = df_no_ll_inj.drop(df_off_street.index)
-    df_cross_street = df_cross_street[
-        df_cross_street["CROSS STREET NAME"].notna()
-        & df_cross_street["ON STREET NAME"].notna()
-    ]
-    df_cross_street.to_csv(cross_street_file_path)
+
+        df_cross_street = df_no_ll_inj[~is_off_street]
+        df_cross_street = df_cross_street[
+            df_cross_street["CROSS STREET NAME"].notna()
+            & df_cross_street["ON STREET NAME"].notna()
+        ]
+        df_cross_street.to_csv(cross_street_file_path, mode=mode, header=header)
 
 
 def main():
@@ -0,0 +1,184 @@
+import argparse
+from pathlib import Path
+
+# Only the standard library is imported here, so `--help` and argument errors
+# return immediately; each subcommand imports the heavy modules it needs.
+from paths import DATA_FOLDER
+
+BOROUGHS = ["manhattan", "bronx", "brooklyn", "queens", "staten_island"]
+
+
+def get_data_folder(args: argparse.Namespace) -> Path:
+    if args.sample is None and args.bbox is None:
+        return DATA_FOLDER
+    return DATA_FOLDER / "sample"
+
+
+def download(args: argparse.Namespace) -> None:
+    import data_sources
+    import geo
+    from data_generator import get_geodataframe, get_open_data_loader
+
+    datasets = args.datasets or list(data_sources.DATASET_METADATA)
+    if "crashes" in datasets:
+        # The crash cube and ledger are derived from the crashes being replaced
+        for data_folder in [DATA_FOLDER, DATA_FOLDER / "sample"]:
+            for file_name in ["crash_cube.pkl", "crash_assignments.pkl"]:
+                (data_folder / file_name).unlink(missing_ok=True)
+
+    loader = get_open_data_loader()
+    for dataset in datasets:
+        print(f"Downloading {dataset} dataset...")
+        metadata = data_sources.DATASET_METADATA[dataset]
+        get_geodataframe(
+            loader,
+            dataset=dataset,
+            geometry_column=metadata.get("geometry_column", None),
+            crs=metadata.get("crs", geo.STD_EPSG),
+            force_download=True,
+        )
+
+
+def build(args: argparse.Namespace) -> None:
+    from data_generator import build_dataset, get_sample_dataframes, load_dataframes
+
+    if args.sample is None and args.bbox is None:
+        dataframes = load_dataframes(force_download=args.force_download)
+    else:
+        dataframes = get_sample_dataframes(
+            borough=args.sample,
+            bbox=args.bbox,
+            buffer=args.buffer,
+            sample_folder=get_data_folder(args),
+            force_download=args.force_download,
+        )
+    build_dataset(
+        dataframes,
+        data_folder=get_data_folder(args),
+        force_rebuild=args.force_download or args.force_rebuild,
+    )
+
+
+def features(args: argparse.Namespace) -> None:
+    import geopandas as gpd
+    import pandas as pd
+
+    import geo
+    from street_topology import StreetGraph
+
+    data_folder = get_data_folder(args)
+    streets = gpd.GeoDataFrame(
+        pd.read_pickle(data_folder / "final_dataset.pkl"),
+        geometry="geometry",
+        crs=geo.NYC_EPSG,
+    )
+    streets["tree_density"] = streets["n_trees"] / streets["shape_leng"]
+
+    print(f"Computing {args.k}-hop neighbour features...")
+    lag_features = StreetGraph(streets).lag_features(
+        streets,
+        ["collision_rate_per_length", "tree_density", "speed_limit"],
+        k=args.k,
+        agg_function=args.agg_function,
+    )
+    lag_features.to_pickle(data_folder / "street_lag_features.pkl")
+
+
+def evaluate(args: argparse.Namespace) -> None:
+    from model_helpers.model_evaluation import get_leaderboard
+
+    data_folder = get_data_folder(args)
+    leaderboard = get_leaderboard(
+        data_folder / "final_dataset_train.pkl",
+        n_splits=args.n_splits,
+        strategy=args.strategy,
+        block_size=args.block_size,
+        n_workers=args.n_workers,
+        threads_per_job=args.threads_per_job,
+    )
+    print(leaderboard)
+    leaderboard.to_csv(data_folder / "model_leaderboard.csv")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Builds and evaluates the road safety dataset."
+    )
+    parser.add_argument(
+        "--sample",
+        choices=BOROUGHS,
+        default=None,
+        help="Works on the streets of one borough, in data/sample",
+    )
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        metavar=("MINX", "MINY", "MAXX", "MAXY"),
+        default=None,
+        help="Works on the streets in a box (EPSG:2263 feet), in data/sample",
+    )
+    subparsers = parser.add_subparsers(required=True)
+
+    download_parser = subparsers.add_parser(
+        "download", help="Downloads the datasets from NYC Open Data"
+    )
+    download_parser.add_argument(
+        "-d", "--datasets", nargs="+", default=None, help="Defaults to all datasets"
+    )
+    download_parser.set_defaults(command=download)
+
+    build_parser = subparsers.add_parser(
+        "build", help="Joins the datasets into the final street dataset"
+    )
+    build_parser.add_argument(
+        "-f",
+        "--force-download",
+        action="store_true",
+        help="Forces the datasets to be downloaded and sampled again",
+    )
+    build_parser.add_argument(
+        "--force-rebuild",
+        action="store_true",
+        help="Rebuilds the cached crash cube",
+    )
+    build_parser.add_argument(
+        "--buffer",
+        type=float,
+        default=30,
+        help="Margin in feet around the sampled streets for other features",
+    )
+    build_parser.set_defaults(command=build)
+
+    features_parser = subparsers.add_parser(
+        "features", help="Computes neighbouring-street features"
+    )
+    features_parser.add_argument("-k", type=int, default=1)
+    features_parser.add_argument("--agg-function", default="mean")
+    features_parser.set_defaults(command=features)
+
+    evaluate_parser = subparsers.add_parser(
+        "evaluate", help="Cross-validates the registered models"
+    )
+    evaluate_parser.add_argument("--n-splits", type=int, default=5)
+    evaluate_parser.add_argument(
+        "--strategy",
+        choices=["kfold", "spatial"],
+        default="kfold",
+        help="Random k-fold or spatially-blocked cross-validation",
+    )
+    evaluate_parser.add_argument(
+        "--block-size",
+        type=float,
+        default=5280,
+        help="Side of the spatial blocks in feet",
+    )
+    evaluate_parser.add_argument("--n-workers", type=int, default=None)
+    evaluate_parser.add_argument("--threads-per-job", type=int, default=1)
+    evaluate_parser.set_defaults(command=evaluate)
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    args.command(args)
@@ -0,0 +1,275 @@
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import sparse
+
+
+def buffer_streets(streets: gpd.GeoDataFrame, buffer: int = 30) -> gpd.GeoDataFrame:
+    streets = streets.drop_duplicates(subset=["physicalid"])
+    return gpd.GeoDataFrame(
+        streets[["physicalid"]],
+        geometry=streets.geometry.buffer(buffer),
+        crs=streets.crs,
+    ).reset_index(drop=True)
+
+
+def assign_crashes_to_streets(
+    crashes: gpd.GeoDataFrame,
+    buffered_streets: gpd.GeoDataFrame,
+    *,
+    date_column: str = "crash_date",
+    id_column: str | None = None,
+) -> pd.DataFrame:
+    """One row per (crash, street) pair where the crash lies in the street buffer.
+
+    Uses the spatial index of `buffered_streets`, so repeated calls with the same
+    streets reuse the tree.
+    """
+    dates = pd.to_datetime(crashes[date_column]).to_numpy()
+    has_date = ~np.isnat(dates)
+    crash_index, street_index = buffered_streets.sindex.query(
+        crashes.geometry.values[has_date], predicate="within"
+    )
+    assignment = {
+        "physicalid": buffered_streets["physicalid"].to_numpy()[street_index],
+        date_column: dates[has_date][crash_index],
+    }
+    if id_column is not None:
+        assignment = {
+            id_column: crashes[id_column].to_numpy()[has_date][crash_index],
+            **assignment,
+        }
+    return pd.DataFrame(assignment)
+
+
+def get_crashes_fingerprint(
+    crashes: gpd.GeoDataFrame,
+    *,
+    date_column: str = "crash_date",
+    id_column: str = "collision_id",
+) -> int:
+    """Hash of the crash ids, dates and locations, to detect stale caches."""
+    geometry = crashes.geometry
+    columns = pd.DataFrame(
+        {
+            id_column: crashes[id_column].to_numpy(),
+            date_column: crashes[date_column].to_numpy(),
+            "x": geometry.x.to_numpy(),
+            "y": geometry.y.to_numpy(),
+        }
+    )
+    return int(pd.util.hash_pandas_object(columns, index=False).sum())
+
+
+def get_streets_fingerprint(streets: gpd.GeoDataFrame) -> int:
+    """Hash of the street geometries, keyed like `buffer_streets`, to detect
+    stale crash assignments."""
+    streets = streets.drop_duplicates(subset=["physicalid"])
+    columns = pd.DataFrame(
+        {
+            "physicalid": streets["physicalid"].to_numpy(),
+            "wkb": shapely.to_wkb(streets.geometry.values),
+        }
+    )
+    return int(pd.util.hash_pandas_object(columns, index=False).sum())
+
+
+class CrashCube:
+    """Sparse street × time matrix of crash counts answering window queries.
+
+    Each row is a `physicalid` and each column a day counted from `origin`.
+    `resolution` is kept for pickles but only `"D"` is supported: coarser numpy
+    bins (e.g. weeks, which start on Thursdays) would snap the window bounds
+    and miscount crashes near them. Window counts use the half-open
+    convention of `calculate_point_road_features(split_by_date=True)`: a crash
+    is counted if `after < date <= until`.
+
+    `source` is free-form metadata about the inputs the cube was built from,
+    saved alongside it so callers can tell whether a cached cube is stale.
+    """
+
+    def __init__(
+        self,
+        counts: sparse.csr_matrix,
+        physicalid: pd.Index,
+        origin: np.datetime64,
+        resolution: str = "D",
+        source: dict | None = None,
+    ):
+        if resolution != "D":
+            raise NotImplementedError(
+                f"Resolution {resolution} has not been implemented."
+            )
+        self.counts = counts.tocsr()
+        self.counts.sum_duplicates()
+        self.counts.sort_indices()
+        self.physicalid = pd.Index(physicalid, name="physicalid")
+        self.origin = np.datetime64(origin, resolution)
+        self.resolution = resolution
+        self.source = source or {}
+        self.n_bins = self.counts.shape[1]
+        self.__build_prefix_sums()
+
+    def __build_prefix_sums(self) -> None:
+        # Flattened (row, bin) keys are sorted because the CSR indices are, so a
+        # single cumulative sum serves as the prefix sum of every row.
+        rows = np.repeat(
+            np.arange(self.counts.shape[0], dtype=np.int64), np.diff(self.counts.indptr)
+        )
+        self.__keys = rows * self.n_bins + self.counts.indices
+        self.__cumulative = np.concatenate([[0], np.cumsum(self.counts.data)])
+
+    @classmethod
+    def from_crashes(
+        cls,
+        crashes: gpd.GeoDataFrame,
+        streets: gpd.GeoDataFrame,
+        *,
+        date_column: str = "crash_date",
+        buffer: int = 30,
+        resolution: str = "D",
+    ) -> "CrashCube":
+        """Assigns every crash to the streets whose buffer contains it, once."""
+        assignment = assign_crashes_to_streets(
+            crashes, buffer_streets(streets, buffer), date_column=date_column
+        )
+        return cls.from_assignment(
+            assignment["physicalid"].to_numpy(),
+            assignment[date_column].to_numpy(),
+            physicalid=pd.Index(streets["physicalid"].unique()),
+            resolution=resolution,
+        )
+
+    @classmethod
+    def from_assignment(
+        cls,
+        crash_physicalid: np.ndarray,
+        crash_dates: np.ndarray,
+        physicalid: pd.Index,
+        *,
+        origin: np.datetime64 | None = None,
+        n_bins: int | None = None,
+        resolution: str = "D",
+    ) -> "CrashCube":
+        dates = np.asarray(crash_dates, dtype=f"datetime64[{resolution}]")
+        if origin is None:
+            origin = dates.min() if len(dates) else np.datetime64("2012-07-01")
+        bins = (dates - np.datetime64(origin, resolution)).astype(np.int64)
+        if n_bins is None:
+            n_bins = int(bins.max()) + 1 if len(bins) else 1
+        rows = physicalid.get_indexer(crash_physicalid)
+        kept = (rows >= 0) & (bins >= 0) & (bins < n_bins)
+        counts = sparse.csr_matrix(
+            (np.ones(kept.sum(), dtype=np.int64), (rows[kept], bins[kept])),
+            shape=(len(physicalid), n_bins),
+        )
+        return cls(counts, physicalid, origin, resolution)
+
+    def update(self, physicalid, dates, weights) -> None:
+        """Adds `weights` (use -1 to retract a crash) to the given street/date bins,
+        growing the time axis if needed."""
+        bins = self.__to_bins(dates)
+        rows = self.physicalid.get_indexer(np.asarray(physicalid))
+        kept = rows >= 0
+        rows, bins = rows[kept], bins[kept]
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.int64), kept.shape)[kept]
+        if len(bins) == 0:
+            return
+        shift = max(0, -int(bins.min()))
+        n_bins = max(self.n_bins + shift, int(bins.max()) + shift + 1)
+        counts = sparse.csr_matrix(
+            (self.counts.data, self.counts.indices + shift, self.counts.indptr),
+            shape=(self.counts.shape[0], n_bins),
+        )
+        delta = sparse.csr_matrix(
+            (weights, (rows, bins + shift)), shape=(self.counts.shape[0], n_bins)
+        )
+        self.counts = (counts + delta).tocsr()
+        self.counts.eliminate_zeros()
+        self.counts.sort_indices()
+        self.origin = self.origin - np.timedelta64(shift, self.resolution)
+        self.n_bins = n_bins
+        self.__build_prefix_sums()
+
+    def __prefix(self, rows: np.ndarray, bins: np.ndarray) -> np.ndarray:
+        """Number of crashes of each row in the bins strictly before `bins`."""
+        bins = np.clip(bins, 0, self.n_bins)
+        row_start = np.searchsorted(self.__keys, rows * self.n_bins)
+        position = np.searchsorted(self.__keys, rows * self.n_bins + bins)
+        return self.__cumulative[position] - self.__cumulative[row_start]
+
+    def __to_bins(self, dates) -> np.ndarray:
+        dates = np.asarray(dates, dtype=f"datetime64[{self.resolution}]")
+        return (dates - self.origin).astype(np.int64)
+
+    def count(self, physicalid, after, until) -> np.ndarray:
+        """Crash counts for each (physicalid, after, until); arguments broadcast."""
+        physicalid, after, until = np.broadcast_arrays(
+            np.asarray(physicalid),
+            np.asarray(after, dtype="datetime64[ns]"),
+            np.asarray(until, dtype="datetime64[ns]"),
+        )
+        rows = self.physicalid.get_indexer(physicalid.ravel())
+        known = rows >= 0
+        rows = np.where(known, rows, 0)
+        counts = self.__prefix(rows, self.__to_bins(until.ravel()) + 1) - self.__prefix(
+            rows, self.__to_bins(after.ravel()) + 1
+        )
+        return np.where(known, counts, 0).reshape(physicalid.shape)
+
+    def collision_rates(
+        self,
+        windows: pd.DataFrame,
+        output_column: str = "collision_rate",
+        cols_to_aggregate_by: list[str] = ["physicalid", "after", "until"],
+    ) -> pd.DataFrame:
+        """Crash counts per window, in the shape returned by
+        `calculate_point_road_features`."""
+        windows = windows[cols_to_aggregate_by].drop_duplicates()
+        counts = self.count(
+            windows["physicalid"].to_numpy(),
+            windows["after"].to_numpy(),
+            windows["until"].to_numpy(),
+        )
+        return pd.DataFrame(
+            {output_column: counts.astype(float)},
+            index=pd.MultiIndex.from_frame(windows),
+        )
+
+    def rolling_counts(
+        self,
+        start: np.datetime64,
+        end: np.datetime64,
+        window: np.timedelta64,
+        step: np.timedelta64 | None = None,
+        physicalid=None,
+    ) -> pd.DataFrame:
+        """Crash counts over a sliding window, one column per window end."""
+        step = window if step is None else step
+        physicalid = self.physicalid if physicalid is None else pd.Index(physicalid)
+        first_end = np.datetime64(start) + window
+        n_windows = max(0, (np.datetime64(end) - first_end) // step + 1)
+        ends = (first_end + step * np.arange(n_windows)).astype("datetime64[ns]")
+        counts = self.count(
+            physicalid.to_numpy()[:, None], ends[None, :] - window, ends[None, :]
+        )
+        return pd.DataFrame(counts, index=physicalid.rename("physicalid"), columns=ends)
+
+    def to_pickle(self, path: Path) -> None:
+        pd.to_pickle(
+            {
+                "counts": self.counts,
+                "physicalid": self.physicalid,
+                "origin": self.origin,
+                "resolution": self.resolution,
+                "source": self.source,
+            },
+            path,
+        )
+
+    @classmethod
+    def read_pickle(cls, path: Path) -> "CrashCube":
+        return cls(**pd.read_pickle(path))
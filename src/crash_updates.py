@@ -0,0 +1,153 @@
+import argparse
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+import geo
+from crash_cube import CrashCube, assign_crashes_to_streets, buffer_streets
+from data_downloader import GeometryFormatter
+from paths import DATA_FOLDER
+
+
+class IncrementalCrashUpdater:
+    """Applies a delta of crash rows to the crash cube and the final dataset.
+
+    `assignments` is the ledger of (collision_id, physicalid, crash_date) pairs
+    the cube was built from; it lets corrected or deleted crashes be retracted
+    by key without touching any other row.
+    """
+
+    def __init__(
+        self,
+        streets: gpd.GeoDataFrame,
+        crash_cube: CrashCube,
+        assignments: pd.DataFrame,
+        *,
+        buffer: int = 30,
+        id_column: str = "collision_id",
+        date_column: str = "crash_date",
+    ):
+        self.buffered_streets = buffer_streets(streets, buffer)
+        self.crash_cube = crash_cube
+        self.assignments = assignments
+        self.id_column = id_column
+        self.date_column = date_column
+
+    def __retract(self, collision_ids: np.ndarray) -> np.ndarray:
+        retracted = self.assignments[self.id_column].isin(collision_ids)
+        old = self.assignments[retracted]
+        self.crash_cube.update(
+            old["physicalid"].to_numpy(), old[self.date_column].to_numpy(), -1
+        )
+        self.assignments = self.assignments[~retracted]
+        return old["physicalid"].unique()
+
+    def apply(
+        self,
+        crashes: gpd.GeoDataFrame,
+        deleted_ids: list | np.ndarray | None = None,
+    ) -> np.ndarray:
+        """Upserts `crashes` (keyed by collision id), removes `deleted_ids`, and
+        returns the physicalids whose counts changed."""
+        collision_ids = crashes[self.id_column].to_numpy()
+        if deleted_ids is not None:
+            collision_ids = np.concatenate([collision_ids, np.asarray(deleted_ids)])
+        retracted_streets = self.__retract(collision_ids)
+
+        new = assign_crashes_to_streets(
+            crashes,
+            self.buffered_streets,
+            date_column=self.date_column,
+            id_column=self.id_column,
+        )
+        self.crash_cube.update(
+            new["physicalid"].to_numpy(), new[self.date_column].to_numpy(), 1
+        )
+        self.assignments = pd.concat([self.assignments, new], ignore_index=True)
+        return np.union1d(retracted_streets, new["physicalid"].unique())
+
+    def refresh_collision_rates(
+        self,
+        dataset: pd.DataFrame,
+        windows: pd.DataFrame,
+        affected_physicalids: np.ndarray,
+    ) -> pd.Index:
+        """Recomputes the collision rate columns of the affected rows in place.
+
+        `windows` holds the `physicalid`, `after` and `until` of each dataset row,
+        sharing the dataset's index. Returns the index of the rewritten rows.
+        """
+        affected = windows[
+            windows["physicalid"].isin(affected_physicalids)
+            & windows.index.isin(dataset.index)
+        ]
+        counts = self.crash_cube.count(
+            affected["physicalid"].to_numpy(),
+            affected["after"].to_numpy(),
+            affected["until"].to_numpy(),
+        )
+        weeks = (affected["until"] - affected["after"]) / np.timedelta64(1, "W")
+        dataset.loc[affected.index, "collision_rate"] = counts / weeks
+        dataset.loc[affected.index, "collision_rate_per_length"] = (
+            dataset.loc[affected.index, "collision_rate"]
+            / dataset.loc[affected.index, "shape_leng"]
+        )
+        return affected.index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Applies new, corrected or deleted crash rows to the final dataset"
+    )
+    parser.add_argument(
+        "updates",
+        type=Path,
+        help="Pickle of raw crash rows from NYC Open Data to insert or replace",
+    )
+    parser.add_argument(
+        "-d",
+        "--deleted",
+        type=Path,
+        default=None,
+        help="Text file with one deleted collision_id per line",
+    )
+    args = parser.parse_args()
+
+    print("Loading crash cube and final dataset...")
+    crash_cube = CrashCube.read_pickle(DATA_FOLDER / "crash_cube.pkl")
+    assignments = pd.read_pickle(DATA_FOLDER / "crash_assignments.pkl")
+    windows = pd.read_pickle(DATA_FOLDER / "collision_windows.pkl")
+    datasets = {
+        name: pd.read_pickle(DATA_FOLDER / f"{name}.pkl")
+        for name in ["final_dataset", "final_dataset_train", "final_dataset_test"]
+    }
+    streets = gpd.GeoDataFrame(
+        datasets["final_dataset"][["physicalid", "geometry"]], crs=geo.NYC_EPSG
+    )
+
+    raw_updates = pd.read_pickle(args.updates)
+    updates = GeometryFormatter(raw_updates).from_lat_long()
+    # Corrections that lost their coordinates can only be retracted
+    deleted_ids = raw_updates.loc[
+        ~raw_updates["collision_id"].isin(updates["collision_id"]), "collision_id"
+    ].tolist()
+    if args.deleted is not None:
+        deleted_ids += args.deleted.read_text().split()
+
+    print("Assigning new crashes to streets...")
+    updater = IncrementalCrashUpdater(streets, crash_cube, assignments)
+    affected_physicalids = updater.apply(updates, deleted_ids=deleted_ids)
+
+    print(f"Refreshing {len(affected_physicalids)} streets...")
+    for name, dataset in datasets.items():
+        rewritten = updater.refresh_collision_rates(
+            dataset, windows, affected_physicalids
+        )
+        if len(rewritten) > 0:
+            dataset.to_pickle(DATA_FOLDER / f"{name}.pkl")
+
+    print("Saving crash cube...")
+    updater.crash_cube.to_pickle(DATA_FOLDER / "crash_cube.pkl")
+    updater.assignments.to_pickle(DATA_FOLDER / "crash_assignments.pkl")
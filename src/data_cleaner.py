@@ -1,10 +1,9 @@
-from pathlib import Path
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.impute import SimpleImputer
 import numpy as np
 
-DATA_FOLDER = Path("data")
+from paths import DATA_FOLDER
 
 
 def main():
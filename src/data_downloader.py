@@ -1,3 +1,5 @@
+import os
+from collections.abc import Iterator
 from pathlib import Path
 
 import geopandas as gpd
@@ -8,6 +10,7 @@ from sodapy import Socrata
 
 import geo
 from data_sources import DATASET_METADATA
+from paths import DATA_FOLDER
 
 
 class GeometryFormatter:
@@ -63,7 +66,7 @@ class OpenDataDownloader:
         limit: int = 3_000_000,
         force_download: bool = False,
     ) -> pd.DataFrame:
-        data_path: Path = Path(f"../data/{dataset}.pkl")
+        data_path: Path = DATA_FOLDER / f"{dataset}.pkl"
         if data_path.exists() and not force_download:
             return pd.read_pickle(data_path).iloc[:limit]
         client = Socrata("data.cityofnewyork.us", app_token=self.app_token)
@@ -71,3 +74,79 @@ class OpenDataDownloader:
         df = pd.DataFrame.from_records(results)
         df.to_pickle(data_path)
         return df
+
+    def load_data_in_chunks(
+        self,
+        dataset: str,
+        *,
+        chunk_size: int = 250_000,
+        limit: int = 3_000_000,
+        force_download: bool = False,
+    ) -> Iterator[pd.DataFrame]:
+        """Yields the dataset `chunk_size` rows at a time, caching every page.
+
+        Reuses the page cache, or else the whole-dataset cache of `load_data`,
+        before downloading anything."""
+        chunks_path: Path = DATA_FOLDER / f"{dataset}_chunks"
+        complete_marker = chunks_path / "complete"
+        if complete_marker.exists() and not force_download:
+            n_rows = 0
+            for chunk_path in sorted(chunks_path.glob("*.pkl")):
+                if n_rows >= limit:
+                    return
+                df = pd.read_pickle(chunk_path).iloc[: limit - n_rows]
+                n_rows += len(df)
+                yield df
+            return
+        data_path: Path = DATA_FOLDER / f"{dataset}.pkl"
+        if data_path.exists() and not force_download:
+            df = pd.read_pickle(data_path).iloc[:limit]
+            for start in range(0, len(df), chunk_size):
+                yield df.iloc[start : start + chunk_size]
+            return
+        os.makedirs(chunks_path, exist_ok=True)
+        for stale_chunk in chunks_path.glob("*.pkl"):
+            stale_chunk.unlink()
+        client = Socrata("data.cityofnewyork.us", app_token=self.app_token)
+        for offset in range(0, limit, chunk_size):
+            results = client.get(
+                DATASET_METADATA[dataset]["endpoint"],
+                limit=min(chunk_size, limit - offset),
+                offset=offset,
+                order=":id",
+            )
+            if not results:
+                break
+            df = pd.DataFrame.from_records(results)
+            df.to_pickle(chunks_path / f"{offset:010d}.pkl")
+            yield df
+            if len(results) < chunk_size:
+                break
+        complete_marker.touch()
+
+    def load_geodata_in_chunks(
+        self,
+        dataset: str,
+        *,
+        chunk_size: int = 250_000,
+        limit: int = 3_000_000,
+        force_download: bool = False,
+    ) -> Iterator[gpd.GeoDataFrame]:
+        """Same as `load_data_in_chunks`, but yields each page as a GeoDataFrame
+        in NYC coordinates, ready for `calculate_point_road_features_in_chunks`."""
+        metadata = DATASET_METADATA[dataset]
+        geometry_column = metadata.get("geometry_column", None)
+        crs = metadata.get("crs", geo.STD_EPSG)
+        for df in self.load_data_in_chunks(
+            dataset, chunk_size=chunk_size, limit=limit, force_download=force_download
+        ):
+            if geometry_column is not None:
+                yield GeometryFormatter(df, crs=crs).from_geometry_column(
+                    geometry_column=geometry_column
+                )
+                continue
+            # Socrata omits null fields, so a page may lack the coordinate columns
+            for column in ["latitude", "longitude"]:
+                if column not in df:
+                    df[column] = None
+            yield GeometryFormatter(df, crs=crs).from_lat_long()
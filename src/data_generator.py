@@ -5,15 +5,22 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-from geopandas import GeoDataFrame
+from geopandas import GeoDataFrame, GeoSeries
+from shapely import box
 from sklearn.model_selection import train_test_split
 
 import data_sources
 import geo
+from crash_cube import (
+    CrashCube,
+    assign_crashes_to_streets,
+    buffer_streets,
+    get_crashes_fingerprint,
+    get_streets_fingerprint,
+)
 from data_downloader import GeometryFormatter, OpenDataDownloader
 from data_helpers import FeatureJoiner, RoadFeaturesCalculator
-
-DATA_FOLDER = Path("../data")
+from paths import DATA_FOLDER
 
 
 def get_open_data_loader() -> OpenDataDownloader:
@@ -37,33 +44,49 @@ def get_geodataframe(
     )
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "-f",
-        "--force-download",
-        action="store_true",
-        help="Forces the datasets to be downloaded",
+def get_crash_cube(
+    crashes: GeoDataFrame,
+    streets: GeoDataFrame,
+    cube_path: Path = DATA_FOLDER / "crash_cube.pkl",
+    assignments_path: Path = DATA_FOLDER / "crash_assignments.pkl",
+    buffer: int = 30,
+    force_rebuild: bool = False,
+) -> CrashCube:
+    # The cached cube is only reused if it was built from the same crashes and
+    # street geometries
+    source = {
+        "crashes": get_crashes_fingerprint(crashes),
+        "streets": get_streets_fingerprint(streets),
+        "buffer": buffer,
+    }
+    if cube_path.exists() and assignments_path.exists() and not force_rebuild:
+        crash_cube = CrashCube.read_pickle(cube_path)
+        if (
+            crash_cube.source == source
+            and streets["physicalid"].isin(crash_cube.physicalid).all()
+        ):
+            return crash_cube
+    # The (collision_id, physicalid) ledger lets crash_updates.py apply deltas
+    assignments = assign_crashes_to_streets(
+        crashes,
+        buffer_streets(streets, buffer),
+        date_column="crash_date",
+        id_column="collision_id",
     )
-    args = parser.parse_args()
-    if args.force_download:
-        print("The datasets will be downloaded from NYC Open Data\n")
+    crash_cube = CrashCube.from_assignment(
+        assignments["physicalid"].to_numpy(),
+        assignments["crash_date"].to_numpy(),
+        physicalid=pd.Index(streets["physicalid"].unique()),
+    )
+    crash_cube.source = source
+    assignments.to_pickle(assignments_path)
+    crash_cube.to_pickle(cube_path)
+    return crash_cube
 
-    columns_to_aggregate_by = ["physicalid", "after", "until"]
-    columns_from_centerline = [
-        "physicalid",
-        "geometry",
-        "bike_lane",
-        "st_width",
-        "shape_leng",
-        "post_type",
-        "pre_type",
-        "st_name",
-    ]
 
+def load_dataframes(force_download: bool = False) -> dict[str, GeoDataFrame]:
     dataframes = dict()
     loader = get_open_data_loader()
-
     for dataset, metadata in data_sources.DATASET_METADATA.items():
         print(f"Loading {dataset} dataset...")
         dataframes[dataset] = get_geodataframe(
@@ -71,8 +94,111 @@ if __name__ == "__main__":
             dataset=dataset,
             geometry_column=metadata.get("geometry_column", None),
             crs=metadata.get("crs", geo.STD_EPSG),
-            force_download=args.force_download,
+            force_download=force_download,
+        )
+    return dataframes
+
+
+def sample_dataframes(
+    dataframes: dict[str, GeoDataFrame],
+    borough: str | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+    buffer: float = 30,
+) -> dict[str, GeoDataFrame]:
+    """Restricts the datasets to the streets of a borough or of a bounding box (in
+    EPSG:2263 feet), plus every other feature within `buffer` feet of them, so
+    that the spatial joins on the sample match those on the full data."""
+    streets = dataframes["centerline"]
+    if borough is not None:
+        streets = streets[
+            streets["borocode"].astype(str) == data_sources.BOROUGH_CODES[borough]
+        ]
+    if bbox is not None:
+        minx, miny, maxx, maxy = (
+            GeoSeries([box(*bbox)], crs=geo.NYC_EPSG).to_crs(streets.crs).total_bounds
+        )
+        streets = streets.cx[minx:maxx, miny:maxy]
+    area = GeoSeries(
+        [box(*streets.to_crs(geo.NYC_EPSG).total_bounds).buffer(buffer)],
+        crs=geo.NYC_EPSG,
+    )
+
+    sample = {"centerline": streets}
+    for dataset, df in dataframes.items():
+        if dataset == "centerline":
+            continue
+        minx, miny, maxx, maxy = area.to_crs(df.crs).total_bounds
+        sample[dataset] = df.cx[minx:maxx, miny:maxy]
+    return sample
+
+
+def get_sample_dataframes(
+    borough: str | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+    buffer: float = 30,
+    sample_folder: Path = DATA_FOLDER / "sample",
+    force_download: bool = False,
+) -> dict[str, GeoDataFrame]:
+    """Loads the sampled datasets from `sample_folder`, only extracting them from
+    the full datasets when the sample area or the full datasets have changed."""
+    metadata_path = sample_folder / "sample_metadata.pkl"
+    metadata = {
+        "borough": borough,
+        "bbox": None if bbox is None else tuple(bbox),
+        "buffer": buffer,
+        "sources": get_dataset_timestamps(),
+    }
+    if (
+        metadata_path.exists()
+        and not force_download
+        and pd.read_pickle(metadata_path) == metadata
+    ):
+        print("Loading sampled datasets...")
+        return {
+            dataset: pd.read_pickle(sample_folder / f"{dataset}.pkl")
+            for dataset in data_sources.DATASET_METADATA
+        }
+
+    dataframes = load_dataframes(force_download=force_download)
+    print("Sampling datasets...")
+    dataframes = sample_dataframes(
+        dataframes, borough=borough, bbox=bbox, buffer=buffer
+    )
+    os.makedirs(sample_folder, exist_ok=True)
+    for dataset, df in dataframes.items():
+        df.to_pickle(sample_folder / f"{dataset}.pkl")
+    metadata["sources"] = get_dataset_timestamps()
+    pd.to_pickle(metadata, metadata_path)
+    return dataframes
+
+
+def get_dataset_timestamps() -> dict[str, int | None]:
+    """Modification times of the downloaded datasets, None if not downloaded."""
+    timestamps = dict()
+    for dataset in data_sources.DATASET_METADATA:
+        data_path = DATA_FOLDER / f"{dataset}.pkl"
+        timestamps[dataset] = (
+            data_path.stat().st_mtime_ns if data_path.exists() else None
         )
+    return timestamps
+
+
+def build_dataset(
+    dataframes: dict[str, GeoDataFrame],
+    data_folder: Path = DATA_FOLDER,
+    force_rebuild: bool = False,
+) -> None:
+    columns_to_aggregate_by = ["physicalid", "after", "until"]
+    columns_from_centerline = [
+        "physicalid",
+        "geometry",
+        "bike_lane",
+        "st_width",
+        "shape_leng",
+        "post_type",
+        "pre_type",
+        "st_name",
+    ]
 
     print("Establishing streets dataset...")
     joiner = FeatureJoiner(
@@ -106,24 +232,25 @@ if __name__ == "__main__":
         output_column="has_humps",
         install_date_column="date_insta",
     )
-    del dataframes["speedhumps"]
 
     print("Dropping irrelevant speed hump rows...")
     joiner.streets = joiner.streets[joiner.streets["until"] > np.datetime64("2013-07")]
     joiner.streets = joiner.streets[joiner.streets["after"] < np.datetime64("2023-03")]
 
     print("Processing crashes data using street information...")
-    crashes = RoadFeaturesCalculator(
-        dataframes["crashes"], joiner.streets
-    ).calculate_point_road_features(
-        output_column="collision_rate",
-        method="uniform",
-        split_by_date=True,
-        date_column="crash_date",
-        cols_to_aggregate_by=columns_to_aggregate_by,
+    os.makedirs(data_folder, exist_ok=True)
+    crash_cube = get_crash_cube(
+        dataframes["crashes"],
+        joiner.streets,
+        cube_path=data_folder / "crash_cube.pkl",
+        assignments_path=data_folder / "crash_assignments.pkl",
+        force_rebuild=force_rebuild,
+    )
+    crashes = crash_cube.collision_rates(
+        joiner.streets, cols_to_aggregate_by=columns_to_aggregate_by
     )
 
-    print("")
+    print("Processing trees data using street information...")
     trees = RoadFeaturesCalculator(
         dataframes["trees"], joiner.streets
     ).calculate_point_road_features(
@@ -131,11 +258,10 @@ if __name__ == "__main__":
     )
 
     print("Processing speed limits data using street information...")
-    dataframes["speedlimits"]["postvz_sl"] = dataframes["speedlimits"][
-        "postvz_sl"
-    ].astype(float)
+    speed_limits = dataframes["speedlimits"].copy()
+    speed_limits["postvz_sl"] = speed_limits["postvz_sl"].astype(float)
     speed_limits = RoadFeaturesCalculator(
-        dataframes["speedlimits"], joiner.streets
+        speed_limits, joiner.streets
     ).calculate_point_road_features(
         output_column="speed_limit",
         method="value",
@@ -145,11 +271,10 @@ if __name__ == "__main__":
     )
 
     print("Processing traffic volumes data using street information...")
-    dataframes["traffic_volumes"]["vol"] = dataframes["traffic_volumes"]["vol"].astype(
-        float
-    )
+    traffic_volumes = dataframes["traffic_volumes"].copy()
+    traffic_volumes["vol"] = traffic_volumes["vol"].astype(float)
     traffic_volumes = RoadFeaturesCalculator(
-        dataframes["traffic_volumes"], joiner.streets
+        traffic_volumes, joiner.streets
     ).calculate_point_road_features(
         "traffic_volume",
         feature_value_column="vol",
@@ -183,6 +308,9 @@ if __name__ == "__main__":
         joiner.streets["collision_rate"] / joiner.streets["shape_leng"]
     )
 
+    joiner.streets[columns_to_aggregate_by].to_pickle(
+        data_folder / "collision_windows.pkl"
+    )
     joiner.streets.drop(columns=["after", "until"], inplace=True)
 
     joiner.streets["has_volume_meas"] = ~joiner.streets["traffic_volume"].isna()
@@ -201,7 +329,24 @@ if __name__ == "__main__":
     )
 
     print("Saving to disk...")
-    os.makedirs(DATA_FOLDER, exist_ok=True)
-    collisions_train.to_pickle(DATA_FOLDER / "final_dataset_train.pkl")
-    collisions_test.to_pickle(DATA_FOLDER / "final_dataset_test.pkl")
-    joiner.streets.to_pickle(DATA_FOLDER / "final_dataset.pkl")
+    collisions_train.to_pickle(data_folder / "final_dataset_train.pkl")
+    collisions_test.to_pickle(data_folder / "final_dataset_test.pkl")
+    joiner.streets.to_pickle(data_folder / "final_dataset.pkl")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-f",
+        "--force-download",
+        action="store_true",
+        help="Forces the datasets to be downloaded",
+    )
+    args = parser.parse_args()
+    if args.force_download:
+        print("The datasets will be downloaded from NYC Open Data\n")
+
+    build_dataset(
+        load_dataframes(force_download=args.force_download),
+        force_rebuild=args.force_download,
+    )
@@ -1,24 +1,37 @@
+from collections.abc import Iterable
 from pathlib import Path
 
 import geopandas as gpd
 import numpy as np
 import pandas as pd
 from numpy import datetime64, timedelta64
-from shapely import is_empty
+from shapely import distance, is_empty
 
 import geo
+from paths import DATA_FOLDER
+
+# Partial aggregates computed per chunk, and how to merge them across chunks
+CHUNK_PARTIAL_AGGREGATES = {
+    "sum": ["sum"],
+    "count": ["count"],
+    "max": ["max"],
+    "min": ["min"],
+    "mean": ["sum", "count"],
+}
+CHUNK_REDUCERS = {"sum": "sum", "count": "sum", "max": "max", "min": "min"}
 
 
 class RoadFeaturesCalculator:
 
-    def __init__(self, features: gpd.GeoDataFrame, streets: gpd.GeoDataFrame):
+    def __init__(self, features: gpd.GeoDataFrame | None, streets: gpd.GeoDataFrame):
         self.features = features
         self.streets = streets
+        self.__buffered_streets: dict[int, gpd.GeoDataFrame] = {}
 
     def __get_intersection_weights(
         self,
         buffer: int = 30,
-        intersection_data_path: Path = Path("../data/intersection_weights.pkl"),
+        intersection_data_path: Path = DATA_FOLDER / "intersection_weights.pkl",
     ) -> gpd.GeoDataFrame:
         if intersection_data_path.exists():
             intersections = pd.read_pickle(intersection_data_path)
@@ -49,6 +62,46 @@ class RoadFeaturesCalculator:
         intersections.to_pickle(intersection_data_path)
         return intersections
 
+    def __assign_to_nearest_streets(
+        self,
+        weighted_features: gpd.GeoDataFrame,
+        max_distance: float,
+        k_nearest: int = 1,
+        split_weight: bool = True,
+    ) -> pd.DataFrame:
+        """Assigns each feature to its `k_nearest` closest streets within
+        `max_distance`, without buffering any geometry. If `split_weight`, the
+        weight is split evenly between those streets."""
+        streets = self.streets.drop_duplicates(subset=["physicalid"])
+        feature_index, street_index = streets.sindex.query(
+            weighted_features.geometry.values,
+            predicate="dwithin",
+            distance=max_distance,
+        )
+        distances = distance(
+            weighted_features.geometry.values[feature_index],
+            streets.geometry.values[street_index],
+        )
+        # Rank the candidate streets of each feature by distance
+        order = np.lexsort((distances, feature_index))
+        feature_index, street_index = feature_index[order], street_index[order]
+        first = np.searchsorted(feature_index, feature_index)
+        keep = np.arange(len(feature_index)) - first < k_nearest
+        feature_index, street_index = feature_index[keep], street_index[keep]
+        n_streets = np.bincount(feature_index)[feature_index]
+
+        assigned_features = (
+            weighted_features.drop(columns="geometry")
+            .iloc[feature_index]
+            .reset_index(drop=True)
+        )
+        if split_weight:
+            assigned_features["weight"] = assigned_features["weight"] / n_streets
+        assigned_features["physicalid"] = streets["physicalid"].to_numpy()[street_index]
+        return self.streets.drop(columns="geometry").merge(
+            assigned_features, how="left", on="physicalid"
+        )
+
     def calculate_linear_road_features(
         self,
         output_column: str,
@@ -81,28 +134,43 @@ class RoadFeaturesCalculator:
             {"until": datetime64("2024-04"), "after": datetime64("2012-07")}
         )
 
-    def calculate_point_road_features(
+    def __get_buffered_streets(self, buffer: int) -> gpd.GeoDataFrame:
+        # Chunked calculations reuse the same buffered streets for every chunk
+        if buffer not in self.__buffered_streets:
+            buffered_streets = self.streets.copy()
+            buffered_streets["geometry"] = buffered_streets["geometry"].buffer(buffer)
+            self.__buffered_streets[buffer] = buffered_streets
+        return self.__buffered_streets[buffer]
+
+    def __assign_point_features(
         self,
-        output_column: str,
+        features: gpd.GeoDataFrame,
         feature_value_column: str | None = None,
         date_column: str | None = None,
         method: str | None = None,
         buffer: int = 30,
         split_by_date: bool = False,
-        agg_function: str = "sum",
-        cols_to_aggregate_by: list[str] = ["physicalid"],
-        intersection_data_path: Path = Path("../data/intersection_weights.pkl"),
+        intersection_data_path: Path = DATA_FOLDER / "intersection_weights.pkl",
+        assignment: str = "within",
+        max_distance: float | None = None,
+        k_nearest: int = 1,
     ) -> pd.DataFrame:
         feature_columns = ["geometry"]
         if date_column is not None:
             feature_columns.append(date_column)
-            self.features[date_column] = self.features[date_column].apply(datetime64)
-        if method == "weighted":
+            features[date_column] = features[date_column].apply(datetime64)
+        if method == "weighted" and assignment == "nearest":
+            # Intersection weights spread a feature over every street whose buffer
+            # contains it; nearest assignment already splits it between the
+            # streets it picks, so each feature starts with a weight of one.
+            weighted_features = features[feature_columns].copy()
+            weighted_features["weight"] = 1.0
+        elif method == "weighted":
             feature_columns.append("weight")
             intersection_weights = self.__get_intersection_weights(
                 buffer=buffer, intersection_data_path=intersection_data_path
             )
-            weighted_features = self.features.sjoin(
+            weighted_features = features.sjoin(
                 intersection_weights, how="left", predicate="within"
             )[feature_columns].fillna(value=1.0)
         elif method == "binary":
@@ -111,11 +179,11 @@ class RoadFeaturesCalculator:
                 buffer=buffer, intersection_data_path=intersection_data_path
             )
             intersection_weights["weight"] = 0
-            weighted_features = self.features.sjoin(
+            weighted_features = features.sjoin(
                 intersection_weights, how="left", predicate="within"
             )[feature_columns].fillna(value=1.0)
         elif method == "uniform":
-            weighted_features = self.features[feature_columns].copy()
+            weighted_features = features[feature_columns].copy()
             weighted_features["weight"] = 1.0
         elif method == "value":
             if not isinstance(feature_value_column, str):
@@ -123,15 +191,25 @@ class RoadFeaturesCalculator:
                     "'feature_value_column' must be a string if 'method' is set to 'value'"
                 )
             feature_columns.append(feature_value_column)
-            weighted_features = self.features[feature_columns].copy()
+            weighted_features = features[feature_columns].copy()
             weighted_features["weight"] = weighted_features[feature_value_column]
         else:
             raise NotImplementedError(f"Method {method} has not been implemented.")
-        buffered_streets = self.streets.copy()
-        buffered_streets["geometry"] = buffered_streets["geometry"].buffer(buffer)
-        street_assignment = weighted_features.sjoin(
-            buffered_streets, how="right", predicate="within"
-        )
+        if assignment == "within":
+            street_assignment = weighted_features.sjoin(
+                self.__get_buffered_streets(buffer), how="right", predicate="within"
+            )
+        elif assignment == "nearest":
+            street_assignment = self.__assign_to_nearest_streets(
+                weighted_features,
+                max_distance=buffer if max_distance is None else max_distance,
+                k_nearest=k_nearest,
+                split_weight=method != "value",
+            )
+        else:
+            raise NotImplementedError(
+                f"Assignment {assignment} has not been implemented."
+            )
         if split_by_date:
             if date_column is None:
                 raise TypeError("date_column cannot be None if split_by_date is True")
@@ -147,6 +225,35 @@ class RoadFeaturesCalculator:
                 ),
                 axis=1,
             )
+        return street_assignment
+
+    def calculate_point_road_features(
+        self,
+        output_column: str,
+        feature_value_column: str | None = None,
+        date_column: str | None = None,
+        method: str | None = None,
+        buffer: int = 30,
+        split_by_date: bool = False,
+        agg_function: str = "sum",
+        cols_to_aggregate_by: list[str] = ["physicalid"],
+        intersection_data_path: Path = DATA_FOLDER / "intersection_weights.pkl",
+        assignment: str = "within",
+        max_distance: float | None = None,
+        k_nearest: int = 1,
+    ) -> pd.DataFrame:
+        street_assignment = self.__assign_point_features(
+            self.features,
+            feature_value_column=feature_value_column,
+            date_column=date_column,
+            method=method,
+            buffer=buffer,
+            split_by_date=split_by_date,
+            intersection_data_path=intersection_data_path,
+            assignment=assignment,
+            max_distance=max_distance,
+            k_nearest=k_nearest,
+        )
         feature_aggregation = (
             street_assignment.groupby(by=cols_to_aggregate_by, dropna=False)[["weight"]]
             .agg(agg_function)
@@ -154,6 +261,75 @@ class RoadFeaturesCalculator:
         )
         return feature_aggregation
 
+    def calculate_point_road_features_in_chunks(
+        self,
+        output_column: str,
+        feature_chunks: Iterable[gpd.GeoDataFrame] | None = None,
+        chunk_size: int = 100_000,
+        feature_value_column: str | None = None,
+        date_column: str | None = None,
+        method: str | None = None,
+        buffer: int = 30,
+        split_by_date: bool = False,
+        agg_function: str = "sum",
+        cols_to_aggregate_by: list[str] = ["physicalid"],
+        intersection_data_path: Path = DATA_FOLDER / "intersection_weights.pkl",
+        assignment: str = "within",
+        max_distance: float | None = None,
+        k_nearest: int = 1,
+    ) -> pd.DataFrame:
+        """Same as `calculate_point_road_features`, but assigns and pre-aggregates
+        the features one chunk at a time, so peak memory is bounded by the chunk
+        size. `feature_chunks` defaults to slices of `self.features`."""
+        if agg_function not in CHUNK_PARTIAL_AGGREGATES:
+            raise NotImplementedError(
+                f"Aggregation {agg_function} cannot be computed in chunks."
+            )
+        if feature_chunks is None:
+            feature_chunks = (
+                self.features.iloc[start : start + chunk_size]
+                for start in range(0, len(self.features), chunk_size)
+            )
+        partial_aggregates = CHUNK_PARTIAL_AGGREGATES[agg_function]
+        aggregation = None
+        for chunk in feature_chunks:
+            street_assignment = self.__assign_point_features(
+                chunk.copy(),
+                feature_value_column=feature_value_column,
+                date_column=date_column,
+                method=method,
+                buffer=buffer,
+                split_by_date=split_by_date,
+                intersection_data_path=intersection_data_path,
+                assignment=assignment,
+                max_distance=max_distance,
+                k_nearest=k_nearest,
+            )
+            chunk_aggregation = street_assignment.groupby(
+                by=cols_to_aggregate_by, dropna=False
+            )["weight"].agg(partial_aggregates)
+            if aggregation is not None:
+                chunk_aggregation = (
+                    pd.concat([aggregation, chunk_aggregation])
+                    .groupby(level=cols_to_aggregate_by, dropna=False)
+                    .agg(
+                        {
+                            column: CHUNK_REDUCERS[column]
+                            for column in partial_aggregates
+                        }
+                    )
+                )
+            aggregation = chunk_aggregation
+        if aggregation is None:
+            raise ValueError("No feature chunks were provided.")
+        if agg_function == "mean":
+            feature_aggregation = aggregation["sum"] / aggregation["count"].replace(
+                0, np.nan
+            )
+        else:
+            feature_aggregation = aggregation[agg_function]
+        return feature_aggregation.to_frame(name=output_column)
+
 
 class FeatureJoiner:
 
@@ -196,7 +372,10 @@ class FeatureJoiner:
         buffer: int = 30,
         date_column: str | None = None,
         split_by_date: bool = False,
-        intersection_data_path: Path = Path("../data/intersection_weights.pkl"),
+        intersection_data_path: Path = DATA_FOLDER / "intersection_weights.pkl",
+        assignment: str = "within",
+        max_distance: float | None = None,
+        k_nearest: int = 1,
     ) -> None:
         streets_with_features = RoadFeaturesCalculator(
             features=features, streets=self.streets
@@ -207,6 +386,9 @@ class FeatureJoiner:
             method=method,
             buffer=buffer,
             intersection_data_path=intersection_data_path,
+            assignment=assignment,
+            max_distance=max_distance,
+            k_nearest=k_nearest,
         )
         self.streets = self.streets.merge(
             streets_with_features, how="left", on="physicalid"
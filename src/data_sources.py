@@ -30,3 +30,12 @@ DATASET_METADATA: dict[str, str] = {
         "endpoint": "693u-uax6",
     },
 }
+
+# Values of the centerline `borocode` column
+BOROUGH_CODES: dict[str, str] = {
+    "manhattan": "1",
+    "bronx": "2",
+    "brooklyn": "3",
+    "queens": "4",
+    "staten_island": "5",
+}
@@ -0,0 +1,205 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import geo
+
+# Lower-left corner of the grid in EPSG:2263; NYC lies north-east of it
+NYC_GRID_ORIGIN = (900_000, 100_000)
+
+
+def unique_rows(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Same as `np.unique(keys, axis=0, return_inverse=True)` for integer keys,
+    but packs each row into one int64 first, which is much faster."""
+    if len(keys) == 0:
+        return keys, np.array([], dtype=np.int64)
+    low = keys.min(axis=0)
+    span = keys.max(axis=0) - low + 1
+    packed = np.zeros(len(keys), dtype=np.int64)
+    for column in range(keys.shape[1]):
+        packed = packed * span[column] + (keys[:, column] - low[column])
+    unique, inverse = np.unique(packed, return_inverse=True)
+    rows = np.empty((len(unique), keys.shape[1]), dtype=np.int64)
+    for column in reversed(range(keys.shape[1])):
+        rows[:, column] = unique % span[column] + low[column]
+        unique = unique // span[column]
+    return rows, inverse.ravel()
+
+
+class GridAggregator:
+    """Bins point datasets into square or pointy-top hexagonal cells in EPSG:2263.
+
+    `cell_size` is the side of a square cell, or the circumradius of a hexagonal
+    one, in feet. Cells are addressed by integer (i, j) indices, so binning is
+    pure array arithmetic with no geometric join.
+    """
+
+    def __init__(
+        self,
+        cell_size: int = 500,
+        shape: str = "square",
+        origin: tuple[int, int] = NYC_GRID_ORIGIN,
+    ):
+        if shape not in ["square", "hex"]:
+            raise NotImplementedError(f"Shape {shape} has not been implemented.")
+        self.cell_size = cell_size
+        self.shape = shape
+        self.origin = origin
+
+    def at_level(self, level: int) -> "GridAggregator":
+        """The grid whose cells are `2**level` times larger."""
+        return GridAggregator(self.cell_size * 2**level, self.shape, self.origin)
+
+    def cell_indices(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """(n, 2) array of the cell indices containing each point."""
+        if self.shape == "square":
+            x = np.floor(x).astype(np.int64) - self.origin[0]
+            y = np.floor(y).astype(np.int64) - self.origin[1]
+            return np.stack(
+                [
+                    np.floor_divide(x, self.cell_size),
+                    np.floor_divide(y, self.cell_size),
+                ],
+                axis=1,
+            )
+        x = (np.asarray(x, dtype=np.float64) - self.origin[0]) / self.cell_size
+        y = (np.asarray(y, dtype=np.float64) - self.origin[1]) / self.cell_size
+        # Axial coordinates, rounded through cube coordinates
+        q = np.sqrt(3) / 3 * x - y / 3
+        r = 2 / 3 * y
+        s = -q - r
+        rq, rr, rs = np.round(q), np.round(r), np.round(s)
+        dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+        rq = np.where(fix_q, -rr - rs, rq)
+        rr = np.where(fix_r, -rq - rs, rr)
+        return np.stack([rq, rr], axis=1).astype(np.int64)
+
+    def cell_centers(self, cells: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        i, j = cells[:, 0], cells[:, 1]
+        if self.shape == "square":
+            x = (i + 0.5) * self.cell_size
+            y = (j + 0.5) * self.cell_size
+        else:
+            x = self.cell_size * np.sqrt(3) * (i + j / 2)
+            y = self.cell_size * 1.5 * j
+        return x + self.origin[0], y + self.origin[1]
+
+    def cell_polygons(self, cells: np.ndarray) -> gpd.GeoSeries:
+        """Cell outlines, for plotting aggregated cells on a map."""
+        x, y = self.cell_centers(cells)
+        if self.shape == "square":
+            half = self.cell_size / 2
+            polygons = shapely.box(x - half, y - half, x + half, y + half)
+        else:
+            angles = np.radians(30 + 60 * np.arange(6))
+            vertices = np.stack(
+                [
+                    x[:, None] + self.cell_size * np.cos(angles),
+                    y[:, None] + self.cell_size * np.sin(angles),
+                ],
+                axis=2,
+            )
+            polygons = shapely.polygons(vertices)
+        return gpd.GeoSeries(polygons, crs=geo.NYC_EPSG)
+
+    def aggregate(
+        self,
+        points: gpd.GeoDataFrame,
+        value_columns: list[str] | None = None,
+        date_column: str | None = None,
+        freq: str | None = None,
+        after: np.datetime64 | None = None,
+        until: np.datetime64 | None = None,
+    ) -> pd.DataFrame:
+        """Counts points (and sums `value_columns`) per cell.
+
+        With `date_column`, points are restricted to `after < date <= until` and,
+        if `freq` is given, also split into periods of that frequency.
+        """
+        points = points[~points.geometry.is_empty & points.geometry.notna()]
+        key_columns = ["i", "j"]
+        keys = [
+            self.cell_indices(
+                points.geometry.x.to_numpy(), points.geometry.y.to_numpy()
+            )
+        ]
+        if date_column is not None:
+            dates = pd.to_datetime(points[date_column])
+            in_window = dates.notna()
+            if after is not None:
+                in_window &= dates > after
+            if until is not None:
+                in_window &= dates <= until
+            in_window = in_window.to_numpy()
+            points, dates, keys = (
+                points[in_window],
+                dates[in_window],
+                [keys[0][in_window]],
+            )
+            if freq is not None:
+                periods = pd.PeriodIndex(dates, freq=freq)
+                keys.insert(0, periods.asi8[:, None])
+                key_columns.insert(0, "period")
+        cells, inverse = unique_rows(np.hstack(keys))
+        aggregation = pd.DataFrame(cells, columns=key_columns)
+        aggregation["count"] = np.bincount(inverse, minlength=len(cells))
+        for column in value_columns or []:
+            aggregation[column] = np.bincount(
+                inverse,
+                weights=points[column].astype(float).fillna(0).to_numpy(),
+                minlength=len(cells),
+            )
+        if "period" in aggregation:
+            aggregation["period"] = pd.PeriodIndex.from_ordinals(
+                aggregation["period"], freq=freq
+            )
+        return aggregation
+
+    def pyramid(self, aggregation: pd.DataFrame, levels: int) -> list[pd.DataFrame]:
+        """Coarser copies of `aggregation`, each summing the cells of the previous
+        level into cells twice as large. Element `k` is at `self.at_level(k)`.
+
+        Square levels are exact. Hexagons do not nest, so each hex cell is
+        assigned to the parent containing its centre and points near parent
+        edges can land in a neighbouring cell; use `self.at_level(k).aggregate`
+        on the points for exact hex counts."""
+        pyramid = [aggregation]
+        key_columns = ["period", "i", "j"] if "period" in aggregation else ["i", "j"]
+        for level in range(1, levels + 1):
+            children = pyramid[-1]
+            child_grid, parent_grid = self.at_level(level - 1), self.at_level(level)
+            parents = children.copy()
+            if self.shape == "square":
+                parents[["i", "j"]] = np.floor_divide(
+                    children[["i", "j"]].to_numpy(), 2
+                )
+            else:
+                x, y = child_grid.cell_centers(children[["i", "j"]].to_numpy())
+                parents[["i", "j"]] = parent_grid.cell_indices(x, y)
+            pyramid.append(
+                parents.groupby(key_columns, as_index=False, sort=True).sum()
+            )
+        return pyramid
+
+    def to_raster(
+        self, aggregation: pd.DataFrame, value_column: str = "count"
+    ) -> tuple[np.ndarray, tuple[float, float, float, float]]:
+        """Dense heatmap of a square-cell aggregation, with its (minx, maxx, miny,
+        maxy) extent for `plt.imshow(..., origin="lower", extent=extent)`."""
+        if self.shape != "square":
+            raise NotImplementedError("Only square grids can be rasterised.")
+        cells = aggregation.groupby(["i", "j"])[value_column].sum()
+        i = cells.index.get_level_values("i").to_numpy()
+        j = cells.index.get_level_values("j").to_numpy()
+        raster = np.zeros((j.max() - j.min() + 1, i.max() - i.min() + 1))
+        raster[j - j.min(), i - i.min()] = cells.to_numpy()
+        extent = (
+            self.origin[0] + i.min() * self.cell_size,
+            self.origin[0] + (i.max() + 1) * self.cell_size,
+            self.origin[1] + j.min() * self.cell_size,
+            self.origin[1] + (j.max() + 1) * self.cell_size,
+        )
+        return raster, extent
@@ -0,0 +1,271 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, clone
+from sklearn.metrics import mean_absolute_error, mean_squared_error
+from sklearn.model_selection import GroupKFold, KFold
+from threadpoolctl import threadpool_limits
+
+from model_helpers.model_loader import ModelLoader
+from model_helpers.model_paths import MODEL_PATHS
+
+TARGET_COLUMN = "collision_rate_per_length"
+NON_FEATURE_COLUMNS = [
+    "physicalid",
+    "geometry",
+    "has_parking_meters",
+    "collision_rate",
+    "collision_rate_per_length",
+    "has_volume_meas",
+]
+
+THREAD_ENV_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+# Per-worker view of the shared feature matrix, set by the pool initializer.
+_worker_data: dict = {}
+
+
+def _attach_shared_data(
+    x_name: str,
+    x_shape: tuple[int, int],
+    y_name: str,
+    y_shape: tuple[int],
+    columns: list[str],
+    n_threads: int,
+) -> None:
+    x_memory = SharedMemory(name=x_name)
+    y_memory = SharedMemory(name=y_name)
+    X = np.ndarray(x_shape, dtype=np.float64, buffer=x_memory.buf)
+    y = np.ndarray(y_shape, dtype=np.float64, buffer=y_memory.buf)
+    # Keep the handles alive for as long as the worker holds views on them.
+    _worker_data["memory"] = (x_memory, y_memory)
+    _worker_data["X"] = pd.DataFrame(X, columns=columns, copy=False)
+    _worker_data["y"] = y
+    _worker_data["n_threads"] = n_threads
+
+
+def _set_thread_environment(n_threads: int) -> dict[str, str | None]:
+    """Sets the BLAS/OpenMP thread variables, returning their previous values.
+
+    These are only read when numpy and friends are first imported, so they must
+    be set in the parent before spawning workers, which inherit its environment.
+    """
+    previous = {variable: os.environ.get(variable) for variable in THREAD_ENV_VARIABLES}
+    for variable in THREAD_ENV_VARIABLES:
+        os.environ[variable] = str(n_threads)
+    return previous
+
+
+def _restore_thread_environment(previous: dict[str, str | None]) -> None:
+    for variable, value in previous.items():
+        if value is None:
+            os.environ.pop(variable, None)
+        else:
+            os.environ[variable] = value
+
+
+def _to_shared_memory(values: np.ndarray) -> SharedMemory:
+    memory = SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, dtype=values.dtype, buffer=memory.buf)[:] = values
+    return memory
+
+
+def _limit_estimator_threads(model: BaseEstimator, n_threads: int) -> BaseEstimator:
+    """Caps any `n_jobs` parameter of the estimator (or its steps) to `n_threads`."""
+    thread_params = {
+        param: n_threads
+        for param in model.get_params(deep=True)
+        if param == "n_jobs" or param.endswith("__n_jobs")
+    }
+    if thread_params:
+        model.set_params(**thread_params)
+    return model
+
+
+def _fit_and_score(
+    model_name: str,
+    model: BaseEstimator,
+    fold: int,
+    train_index: np.ndarray,
+    test_index: np.ndarray,
+) -> dict:
+    X, y, n_threads = _worker_data["X"], _worker_data["y"], _worker_data["n_threads"]
+    model = _limit_estimator_threads(model, n_threads)
+    with threadpool_limits(limits=n_threads):
+        start = time.perf_counter()
+        model.fit(X.iloc[train_index], y[train_index])
+        fit_time = time.perf_counter() - start
+        start = time.perf_counter()
+        y_pred = model.predict(X.iloc[test_index])
+        score_time = time.perf_counter() - start
+    return {
+        "model": model_name,
+        "fold": fold,
+        "mse": mean_squared_error(y[test_index], y_pred),
+        "mae": mean_absolute_error(y[test_index], y_pred),
+        "fit_time": fit_time,
+        "score_time": score_time,
+    }
+
+
+def get_spatial_blocks(
+    x: np.ndarray, y: np.ndarray, block_size: float = 5280
+) -> np.ndarray:
+    """Labels each point with the square block (in EPSG:2263 feet) containing it."""
+    block_x = np.floor_divide(x, block_size).astype(np.int64)
+    block_y = np.floor_divide(y, block_size).astype(np.int64)
+    _, blocks = np.unique(
+        np.stack([block_x, block_y], axis=1), axis=0, return_inverse=True
+    )
+    return blocks.ravel()
+
+
+class CrossValidationHarness:
+    """Trains and scores a set of models under cross-validation on a process pool."""
+
+    def __init__(
+        self,
+        models: dict[str, BaseEstimator],
+        *,
+        n_splits: int = 5,
+        strategy: str = "kfold",
+        n_workers: int | None = None,
+        threads_per_job: int = 1,
+        random_state: int = 316_203_477,
+    ):
+        self.models = models
+        self.n_splits = n_splits
+        self.strategy = strategy
+        self.n_workers = n_workers or max(1, (os.cpu_count() or 1) // threads_per_job)
+        self.threads_per_job = threads_per_job
+        self.random_state = random_state
+
+    def get_splits(
+        self, X: pd.DataFrame, groups: np.ndarray | None = None
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        if self.strategy == "kfold":
+            splitter = KFold(
+                n_splits=self.n_splits, shuffle=True, random_state=self.random_state
+            )
+            return list(splitter.split(X))
+        elif self.strategy == "spatial":
+            if groups is None:
+                raise TypeError("groups cannot be None if strategy is 'spatial'")
+            return list(GroupKFold(n_splits=self.n_splits).split(X, groups=groups))
+        raise NotImplementedError(f"Strategy {self.strategy} has not been implemented.")
+
+    def evaluate(
+        self, X: pd.DataFrame, y: pd.Series, groups: np.ndarray | None = None
+    ) -> pd.DataFrame:
+        """Runs every (model, fold) job and returns the per-fold scores."""
+        X_values = np.ascontiguousarray(X.to_numpy(dtype=np.float64))
+        y_values = np.ascontiguousarray(np.asarray(y, dtype=np.float64))
+        splits = self.get_splits(X, groups)
+
+        x_memory = _to_shared_memory(X_values)
+        y_memory = _to_shared_memory(y_values)
+        del X_values, y_values
+        previous_environment = _set_thread_environment(self.threads_per_job)
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.n_workers,
+                mp_context=get_context("spawn"),
+                initializer=_attach_shared_data,
+                initargs=(
+                    x_memory.name,
+                    X.shape,
+                    y_memory.name,
+                    (len(y),),
+                    list(X.columns),
+                    self.threads_per_job,
+                ),
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        _fit_and_score,
+                        model_name,
+                        clone(model),
+                        fold,
+                        train_index,
+                        test_index,
+                    )
+                    for model_name, model in self.models.items()
+                    for fold, (train_index, test_index) in enumerate(splits)
+                ]
+                results = [future.result() for future in futures]
+        finally:
+            _restore_thread_environment(previous_environment)
+            x_memory.close()
+            x_memory.unlink()
+            y_memory.close()
+            y_memory.unlink()
+        return pd.DataFrame(results)
+
+    def leaderboard(
+        self, X: pd.DataFrame, y: pd.Series, groups: np.ndarray | None = None
+    ) -> pd.DataFrame:
+        """Aggregates the fold scores into one row per model, sorted by MSE."""
+        scores = self.evaluate(X, y, groups)
+        return (
+            scores.groupby("model")
+            .agg(
+                mse=("mse", "mean"),
+                mse_std=("mse", "std"),
+                mae=("mae", "mean"),
+                mae_std=("mae", "std"),
+                fit_time=("fit_time", "sum"),
+                score_time=("score_time", "sum"),
+            )
+            .sort_values(by="mse")
+        )
+
+
+def load_registered_models() -> dict[str, BaseEstimator]:
+    loader = ModelLoader()
+    return {model_type: loader.load(model_type) for model_type in MODEL_PATHS}
+
+
+def get_training_data(
+    collisions: pd.DataFrame, block_size: float = 5280
+) -> tuple[pd.DataFrame, pd.Series, np.ndarray]:
+    collisions = collisions[collisions["has_volume_meas"]]
+    centroids = collisions.geometry.centroid
+    groups = get_spatial_blocks(
+        centroids.x.to_numpy(), centroids.y.to_numpy(), block_size=block_size
+    )
+    X = collisions.drop(columns=NON_FEATURE_COLUMNS)
+    y = collisions[TARGET_COLUMN]
+    return X, y, groups
+
+
+def get_leaderboard(
+    dataset_path: Path,
+    n_splits: int = 5,
+    strategy: str = "kfold",
+    block_size: float = 5280,
+    n_workers: int | None = None,
+    threads_per_job: int = 1,
+) -> pd.DataFrame:
+    X, y, groups = get_training_data(
+        pd.read_pickle(dataset_path), block_size=block_size
+    )
+    harness = CrossValidationHarness(
+        load_registered_models(),
+        n_splits=n_splits,
+        strategy=strategy,
+        n_workers=n_workers,
+        threads_per_job=threads_per_job,
+    )
+    return harness.leaderboard(X, y, groups)
@@ -1,7 +1,9 @@
+from paths import MODELS_FOLDER
+
 MODEL_PATHS = {
-    "baseline": "../models/regression/baseline.pkl",
-    "linear": "../models/regression/base_linear.pkl",
-    "knn": "../models/regression/knn.pkl",
-    "random_forest": "../models/regression/random_forest.pkl",
-    "xgboost": "../models/regression/xgboost.pkl",
+    "baseline": MODELS_FOLDER / "regression" / "baseline.pkl",
+    "linear": MODELS_FOLDER / "regression" / "base_linear.pkl",
+    "knn": MODELS_FOLDER / "regression" / "knn.pkl",
+    "random_forest": MODELS_FOLDER / "regression" / "random_forest.pkl",
+    "xgboost": MODELS_FOLDER / "regression" / "xgboost.pkl",
 }
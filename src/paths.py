@@ -0,0 +1,6 @@
+from pathlib import Path
+
+# Resolved from this file so scripts work from any working directory
+ROOT_FOLDER = Path(__file__).resolve().parent.parent
+DATA_FOLDER = ROOT_FOLDER / "data"
+MODELS_FOLDER = ROOT_FOLDER / "models"
@@ -0,0 +1,235 @@
+import argparse
+import json
+import pickle
+import threading
+from email.utils import formatdate
+from functools import lru_cache
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import geo
+from paths import DATA_FOLDER
+
+
+class StreetQueryIndex:
+    """Read-only lookups over the final street dataset.
+
+    Rows are indexed by `physicalid` with a hash map and by geometry with an
+    STRtree. Coordinates are in EPSG:2263 feet unless `lonlat` is set.
+    """
+
+    def __init__(self, streets: gpd.GeoDataFrame):
+        self.streets = streets.reset_index(drop=True)
+        self.rows_by_physicalid = self.streets.groupby("physicalid").indices
+        self.tree = shapely.STRtree(self.streets.geometry.values)
+
+    @classmethod
+    def read_pickle(cls, path: Path) -> "StreetQueryIndex":
+        streets = pd.read_pickle(path)
+        return cls(gpd.GeoDataFrame(streets, geometry="geometry", crs=geo.NYC_EPSG))
+
+    def __to_nyc_coordinates(self, x: list[float], y: list[float]) -> np.ndarray:
+        points = gpd.GeoSeries(gpd.points_from_xy(x, y), crs=geo.STD_EPSG)
+        points = points.to_crs(geo.NYC_EPSG)
+        return np.stack([points.x.to_numpy(), points.y.to_numpy()], axis=1)
+
+    def by_physicalid(self, physicalids: list[int]) -> gpd.GeoDataFrame:
+        rows = [
+            self.rows_by_physicalid[physicalid]
+            for physicalid in physicalids
+            if physicalid in self.rows_by_physicalid
+        ]
+        rows = np.concatenate(rows) if rows else np.array([], dtype=int)
+        return self.streets.iloc[rows]
+
+    def in_bbox(
+        self,
+        minx: float,
+        miny: float,
+        maxx: float,
+        maxy: float,
+        lonlat: bool = False,
+    ) -> gpd.GeoDataFrame:
+        if lonlat:
+            (minx, miny), (maxx, maxy) = self.__to_nyc_coordinates(
+                [minx, maxx], [miny, maxy]
+            )
+        rows = self.tree.query(shapely.box(minx, miny, maxx, maxy), "intersects")
+        return self.streets.iloc[np.sort(rows)]
+
+    def within_radius(
+        self, x: float, y: float, radius: float, lonlat: bool = False
+    ) -> gpd.GeoDataFrame:
+        """Streets within `radius` feet of the point."""
+        if lonlat:
+            ((x, y),) = self.__to_nyc_coordinates([x], [y])
+        rows = self.tree.query(shapely.Point(x, y), "dwithin", distance=radius)
+        return self.streets.iloc[np.sort(rows)]
+
+
+def to_geojson(streets: gpd.GeoDataFrame) -> bytes:
+    return streets.to_crs(geo.STD_EPSG).to_json(drop_id=True).encode()
+
+
+class StreetQueryServer(ThreadingHTTPServer):
+    """HTTP front end for a `StreetQueryIndex` over the dataset at `dataset_path`.
+
+    Responses are GeoJSON, cached in memory by normalised query, and served with
+    HTTP/1.1 keep-alive so clients can reuse a single connection. The dataset is
+    rewritten by crash_updates.py, so its modification time is checked on every
+    request: a newer file is reloaded and the response cache cleared, and it is
+    also sent as the ETag so downstream caches revalidate.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        dataset_path: Path,
+        cache_size: int = 4096,
+    ):
+        super().__init__(address, StreetQueryHandler)
+        self.dataset_path = dataset_path
+        self.version: int | None = None
+        self.index: StreetQueryIndex | None = None
+        self.reload_lock = threading.Lock()
+        self.render = lru_cache(maxsize=cache_size)(self.__render)
+        self.refresh()
+
+    def refresh(self) -> int:
+        """Reloads the index if the dataset changed, and returns its version."""
+        version = self.dataset_path.stat().st_mtime_ns
+        if version != self.version:
+            with self.reload_lock:
+                if version != self.version:
+                    try:
+                        index = StreetQueryIndex.read_pickle(self.dataset_path)
+                    except (EOFError, pickle.UnpicklingError):
+                        # Still being written; keep serving the previous version
+                        if self.index is None:
+                            raise
+                        return self.version
+                    self.index = index
+                    self.render.cache_clear()
+                    self.version = version
+        return self.version
+
+    def __render(self, route: str, params: tuple[tuple[str, str], ...]) -> bytes:
+        params = dict(params)
+        lonlat = params.get("lonlat", "false").lower() == "true"
+        if route == "/streets":
+            physicalids = [int(i) for i in params["ids"].split(",") if i]
+            return to_geojson(self.index.by_physicalid(physicalids))
+        elif route == "/bbox":
+            bounds = [float(params[k]) for k in ["minx", "miny", "maxx", "maxy"]]
+            return to_geojson(self.index.in_bbox(*bounds, lonlat=lonlat))
+        elif route == "/radius":
+            return to_geojson(
+                self.index.within_radius(
+                    float(params["x"]),
+                    float(params["y"]),
+                    float(params["radius"]),
+                    lonlat=lonlat,
+                )
+            )
+        raise LookupError(route)
+
+
+class StreetQueryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; avoid Nagle delays on keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        params = tuple(sorted((k, v[-1]) for k, v in parse_qs(url.query).items()))
+        version = self.server.refresh()
+        etag = f'"{version}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.__respond(304, b"", version)
+            return
+        try:
+            body = self.server.render(url.path.rstrip("/"), params)
+        except LookupError:
+            self.__respond(404, b'{"error": "unknown route or missing parameter"}')
+            return
+        except ValueError as e:
+            self.__respond(400, json.dumps({"error": str(e)}).encode())
+            return
+        self.__respond(200, body, version)
+
+    def __respond(self, status: int, body: bytes, version: int | None = None) -> None:
+        self.send_response(status)
+        if status != 304:
+            self.send_header("Content-Type", "application/geo+json")
+            self.send_header("Content-Length", str(len(body)))
+        # Caches must revalidate, since the dataset is refreshed in place
+        if version is not None:
+            self.send_header("ETag", f'"{version}"')
+            self.send_header("Last-Modified", formatdate(version / 1e9, usegmt=True))
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class StreetQueryClient:
+    """Queries a `StreetQueryServer` over one persistent connection."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8050):
+        self.connection = HTTPConnection(host, port)
+
+    def __get(self, route: str, params: dict) -> gpd.GeoDataFrame:
+        self.connection.request("GET", f"{route}?{urlencode(params)}")
+        response = self.connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"Query failed ({response.status}): {body.decode()}")
+        features = json.loads(body)["features"]
+        return gpd.GeoDataFrame.from_features(features, crs=geo.STD_EPSG)
+
+    def by_physicalid(self, physicalids: list[int]) -> gpd.GeoDataFrame:
+        return self.__get("/streets", {"ids": ",".join(map(str, physicalids))})
+
+    def in_bbox(
+        self, minx: float, miny: float, maxx: float, maxy: float, lonlat=False
+    ) -> gpd.GeoDataFrame:
+        return self.__get(
+            "/bbox",
+            {"minx": minx, "miny": miny, "maxx": maxx, "maxy": maxy, "lonlat": lonlat},
+        )
+
+    def within_radius(
+        self, x: float, y: float, radius: float, lonlat=False
+    ) -> gpd.GeoDataFrame:
+        return self.__get(
+            "/radius", {"x": x, "y": y, "radius": radius, "lonlat": lonlat}
+        )
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument(
+        "--dataset", type=Path, default=DATA_FOLDER / "final_dataset.pkl"
+    )
+    args = parser.parse_args()
+
+    print("Loading street dataset...")
+    server = StreetQueryServer((args.host, args.port), args.dataset)
+    print(f"Serving street queries on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,113 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import sparse
+
+
+class StreetGraph:
+    """Sparse adjacency between street segments sharing a centerline endpoint.
+
+    Endpoints are snapped to a grid of side `tolerance` (in EPSG:2263 feet), and
+    two segments are neighbours when they share a snapped endpoint. Neighbour
+    aggregates are computed as sparse matrix-vector products.
+    """
+
+    def __init__(self, streets: gpd.GeoDataFrame, tolerance: float = 1.0):
+        streets = streets.drop_duplicates(subset=["physicalid"])
+        self.physicalid = pd.Index(streets["physicalid"].to_numpy(), name="physicalid")
+        self.tolerance = tolerance
+        self.adjacency = self.__build_adjacency(streets.geometry.values)
+        self.__k_hop_cache: dict[int, sparse.csr_matrix] = {1: self.adjacency}
+
+    def __build_adjacency(self, geometry: np.ndarray) -> sparse.csr_matrix:
+        # Every part of a MultiLineString contributes both of its endpoints
+        parts, street_index = shapely.get_parts(geometry, return_index=True)
+        endpoints = np.concatenate(
+            [
+                shapely.get_coordinates(shapely.get_point(parts, 0)),
+                shapely.get_coordinates(shapely.get_point(parts, -1)),
+            ]
+        )
+        street_index = np.concatenate([street_index, street_index])
+        snapped = np.round(endpoints / self.tolerance).astype(np.int64)
+        _, node_index = np.unique(snapped, axis=0, return_inverse=True)
+        node_index = node_index.ravel()
+
+        n_streets = len(geometry)
+        incidence = sparse.csr_matrix(
+            (np.ones(len(street_index), dtype=np.int32), (street_index, node_index)),
+            shape=(n_streets, node_index.max() + 1 if len(node_index) else 0),
+        )
+        incidence.data[:] = 1
+        adjacency = (incidence @ incidence.T).tocsr()
+        adjacency.setdiag(0)
+        adjacency.eliminate_zeros()
+        adjacency.data[:] = 1
+        return adjacency.astype(np.float64)
+
+    @property
+    def degree(self) -> pd.Series:
+        return pd.Series(
+            np.asarray(self.adjacency.sum(axis=1)).ravel(),
+            index=self.physicalid,
+            name="degree",
+        )
+
+    def k_hop_adjacency(self, k: int = 1) -> sparse.csr_matrix:
+        """Segments reachable in at most `k` hops, excluding the segment itself."""
+        if k < 1:
+            raise ValueError("k must be a positive integer")
+        if k not in self.__k_hop_cache:
+            identity = sparse.identity(self.adjacency.shape[0], format="csr")
+            reach = self.adjacency + identity
+            step = reach.copy()
+            for _ in range(k - 1):
+                reach = reach @ step
+                reach.data[:] = 1
+            reach = reach.tocsr()
+            reach.setdiag(0)
+            reach.eliminate_zeros()
+            reach.data[:] = 1
+            self.__k_hop_cache[k] = reach
+        return self.__k_hop_cache[k]
+
+    def spatial_lag(
+        self, values: pd.Series, k: int = 1, agg_function: str = "mean"
+    ) -> pd.Series:
+        """Aggregates `values` (indexed by physicalid) over each segment's k-hop
+        neighbours. Missing values are ignored."""
+        aligned = values.groupby(level=0).mean().reindex(self.physicalid).to_numpy()
+        present = ~np.isnan(aligned)
+        adjacency = self.k_hop_adjacency(k)
+        total = adjacency @ np.where(present, aligned, 0.0)
+        if agg_function == "sum":
+            lag = total
+        elif agg_function == "mean":
+            count = adjacency @ present.astype(np.float64)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                lag = np.where(count > 0, total / count, np.nan)
+        else:
+            raise NotImplementedError(
+                f"Aggregation {agg_function} is not implemented for spatial_lag."
+            )
+        return pd.Series(lag, index=self.physicalid, name=values.name)
+
+    def lag_features(
+        self,
+        streets: pd.DataFrame,
+        columns: list[str],
+        k: int = 1,
+        agg_function: str = "mean",
+    ) -> pd.DataFrame:
+        """Returns one `<column>_lag<k>` column per input column, indexed by
+        physicalid."""
+        per_street = streets.groupby("physicalid")[columns].mean()
+        return pd.DataFrame(
+            {
+                f"{column}_lag{k}": self.spatial_lag(
+                    per_street[column], k=k, agg_function=agg_function
+                )
+                for column in columns
+            }
+        )